@@ -1,6 +1,8 @@
 import random
 import os
-import shutil
+import sys
+import itertools
+import subprocess
 import yaml
 import json
 
@@ -8,9 +10,13 @@ import json
 import click
 
 # Custom modules and classes
-from nodes.Datagen import DataGen
-from nodes.Inference import Inferencer
-from nodes.AnnotMaker import COCOConverter
+from nodes.Datagen import DataGen, in_shard, is_video
+from nodes.AnnotMaker import COCOConverter, load_coco
+from nodes.Archiver import ZipArchiver
+from nodes.Journal import Journal
+from nodes.Merger import merge_archives
+from nodes.Profiler import NullProfiler
+from nodes.Server import submit_job
 
 
 class LengthMismatchError(Exception):
@@ -47,11 +53,422 @@ def generate_and_save_class_list(original_classes, file_name="new_classes.json")
     print(f"JSON for CVAT saved to file {file_name}")
 
 
+def parse_shard(shard):
+    """
+    Parses the shard option given as k/N.
+
+    Parameters:
+        shard (str | None): Shard option value.
+
+    Returns:
+        tuple | None: Shard index and number of shards, None without sharding.
+    """
+    if shard is None:
+        return None
+    try:
+        index, count = (int(value) for value in shard.split("/"))
+    except ValueError:
+        raise click.BadParameter(f"Shard must be given as k/N, got '{shard}'")
+    if not 0 <= index < count:
+        raise click.BadParameter(f"Shard index must be in the range 0..{count - 1}, got {index}")
+    return index, count
+
+
+def parse_overrides(overrides):
+    """
+    Parses the config overrides given as KEY=VALUE.
+
+    Parameters:
+        overrides (tuple): Override option values, the values are parsed as YAML.
+
+    Returns:
+        dict: Config values by key.
+    """
+    parsed = {}
+    for override in overrides:
+        key, separator, value = override.partition("=")
+        if not separator:
+            raise click.BadParameter(f"Override must be given as KEY=VALUE, got '{override}'")
+        parsed[key.strip()] = yaml.safe_load(value)
+    return parsed
+
+
+def save_photos(input_folder):
+    """
+    Creates a zip archive with the photos to upload to CVAT.
+
+    Parameters:
+        input_folder (str): Folder with images or a video file.
+
+    Returns:
+        None
+    """
+    if is_video(input_folder):
+        print(f"The video {input_folder} can be uploaded to CVAT as is")
+        return
+    # Create a zip archive for uploading to CVAT straight from the source folder
+    with ZipArchiver("images_for_cvat.zip") as archive:
+        archive.add_folder(input_folder)
+    print("Zip archive for uploading to CVAT: images_for_cvat.zip")
+
+
+def run_local_shards(options, count, classes_cvat, classes_coco):
+    """
+    Runs one AutoCvat process per shard on this machine and merges their archives.
+
+    Parameters:
+        options (dict): CLI options of the current run.
+        count (int): Number of shards.
+        classes_cvat (list): CVAT names of the config classes.
+        classes_coco (list): Model class IDs of the config classes.
+
+    Returns:
+        None
+    """
+    result_folder = options["annotations_zip"]
+    # Share the CPU cores between the processes instead of oversubscribing them
+    env = dict(os.environ, OMP_NUM_THREADS=str(max(1, (os.cpu_count() or 1) // count)))
+
+    processes = []
+    shard_zips = []
+    for index in range(count):
+        shard_options = dict(
+            options,
+            shard=f"{index}/{count}",
+            local_shards=None,
+            save_photo=False,
+            cvat_json=False,
+            annotations_zip=f"{result_folder}_shard{index}",
+        )
+        if options.get("max_memory") is not None:
+            # The memory budget is shared between the processes like the CPU cores
+            shard_options["max_memory"] = options["max_memory"] / count
+        command = [sys.executable, os.path.abspath(__file__)]
+        for name, value in shard_options.items():
+            # Options given several times, like override, are repeated
+            for item in value if isinstance(value, (tuple, list)) else [value]:
+                if item is not None:
+                    command.append(f"--{name}={item}")
+        processes.append(subprocess.Popen(command, env=env))
+        shard_zips.append(shard_options["annotations_zip"] + ".zip")
+
+    failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise click.ClickException(f"Shards {failed} of {count} failed")
+
+    merge_archives(shard_zips, result_folder + ".zip", classes_cvat, classes_coco)
+    for shard_zip in shard_zips:
+        os.remove(shard_zip)
+
+
+def model_routes(configs, weights, all_conf=None):
+    """
+    Builds the list of models of a run with the classes each of them annotates.
+
+    Without a models list in the configuration file the run has a single model, the --weights
+    one, with the top-level names and confs. Each model of the list gets an offset added to its
+    class IDs, so the classes of different models stay distinct in the export.
+
+    Parameters:
+        configs (dict): Loaded configuration file.
+        weights (str): Weights given with --weights.
+        all_conf (float, optional): Confidence threshold of all classes, overriding the confs.
+            Defaults to None.
+
+    Returns:
+        list: One dict per model with weights, names, confs, conf, imgsz, iou and class_offset.
+    """
+    entries = configs.get("models") or [{"weights": weights}]
+    routes = []
+    class_offset = 0
+    for entry in entries:
+        if "weights" not in entry or (len(entries) > 1 and "names" not in entry):
+            raise click.ClickException(
+                "Every entry of models in the config file needs weights and names"
+            )
+        names = entry.get("names", configs.get("names"))
+        if all_conf is not None:
+            dict_confs = {}
+            conf = all_conf
+        else:
+            dict_confs = entry.get("confs", configs.get("confs", {}))
+            if list(names) != list(dict_confs):
+                raise LengthMismatchError(
+                    "Class list and confidence threshold dictionary keys list do not match. "
+                    "Each class must correspond to a confidence threshold."
+                )
+            # default conf as min conf of classes
+            conf = min((float(value) for value in dict_confs.values()))
+        routes.append(
+            {
+                "weights": entry["weights"],
+                "names": names,
+                "confs": dict_confs,
+                "conf": conf,
+                "imgsz": entry.get("imgsz", configs.get("imgsz", 640)),
+                "iou": entry.get("iou", configs.get("iou", 0.8)),
+                "class_offset": class_offset,
+            }
+        )
+        class_offset += max(names) + 1
+    return routes
+
+
+def route_classes(routes):
+    """
+    Lists the classes of all models of a run with their global class IDs.
+
+    Parameters:
+        routes (list): Models of the run built by model_routes.
+
+    Returns:
+        tuple: CVAT names of the config classes and their model class IDs shifted by the offset
+            of their model.
+    """
+    classes_cvat = [name for route in routes for name in route["names"].values()]
+    classes_coco = [
+        route["class_offset"] + class_id for route in routes for class_id in route["names"]
+    ]
+    return classes_cvat, classes_coco
+
+
+def run(options, models=None):
+    """
+    Annotates a CVAT task with the given CLI options.
+
+    Parameters:
+        options (dict): Values of the AutoCvat CLI options.
+        models (ModelCache, optional): Loaded models to reuse, e.g. in the annotation server.
+            Defaults to None.
+
+    Returns:
+        None
+    """
+    # ultralytics and torch are only imported when the inference runs in this process
+    from nodes.Inference import Inferencer
+
+    result_folder = options["annotations_zip"]
+    model_pth = options["weights"]
+    input_folder = options["img_folder"]
+    configs = options["yaml_pth"]
+    save_photo = bool(options["save_photo"])
+    cvat_json = bool(options["cvat_json"])
+    conf = options["all_conf"]
+    use_box_propt_sam = options["zero_shot_segmentation"]
+    batch_size = options["batch_size"]
+    resume = bool(options["resume"])
+    merge_with = options["merge_with"]
+    shard = parse_shard(options["shard"])
+    local_shards = options["local_shards"]
+    frame_stride = options["frame_stride"]
+    max_frames = options["max_frames"]
+    video = is_video(input_folder)
+    # The hooks of the pipeline stages do nothing unless profiling is on
+    if options["profile"]:
+        from nodes.Profiler import Profiler
+
+        profiler = Profiler()
+    else:
+        profiler = NullProfiler()
+
+    # Load data from YAML file
+    with open(configs, "r") as yaml_file:
+        configs = yaml.safe_load(yaml_file)
+    configs.update(parse_overrides(options["override"]))
+    routes = model_routes(configs, model_pth, conf)
+    classes_cvat, classes_coco = route_classes(routes)
+    if batch_size is None:
+        batch_size = configs.get("batch_size", 1)
+
+    if save_photo:
+        with profiler.stage("photo_archive"):
+            save_photos(input_folder)
+
+    if local_shards is not None and local_shards > 1:
+        # Each shard is processed by a separate AutoCvat process, then the archives are merged
+        run_local_shards(options, local_shards, classes_cvat, classes_coco)
+        print(f"Annotations are located at: {result_folder}.zip")
+        if cvat_json:
+            generate_and_save_class_list(classes_cvat)
+        return
+
+    journal = None
+    if resume:
+        # Results of the images processed by an interrupted run with the same settings are reused
+        journal_settings = dict(
+            configs,
+            merge_with=merge_with,
+            shard=options["shard"],
+            weights=model_pth,
+            img_folder=input_folder,
+            all_conf=conf,
+            zero_shot_segmentation=use_box_propt_sam,
+            backend=options["backend"],
+            frame_stride=frame_stride,
+            max_frames=max_frames,
+        )
+        journal = Journal(result_folder + ".journal.jsonl", journal_settings)
+        print(f"Resuming: {len(journal.file_names)} images are already annotated in the journal")
+
+    previous = None
+    previous_files = set()
+    start_id = None
+    if merge_with is not None:
+        # Incremental mode: images of the previous export keep their IDs and are not annotated again
+        previous = load_coco(merge_with)
+        previous_files = {image["file_name"] for image in previous["images"]}
+        start_id = max((image["id"] for image in previous["images"]), default=0) + 1
+        print(f"Merging with {merge_with}: {len(previous_files)} images are already annotated")
+
+    # Lazily iterate over the images, pixel data is decoded only right before inference
+    # (frames of a video are decoded one by one as the stream is read)
+    datagen = DataGen(input_folder, frame_stride, max_frames)
+    elements = datagen.stream(
+        skip=journal.file_names if journal else (),
+        exclude=previous_files,
+        start_id=start_id,
+        shard=shard,
+    )
+
+    segment = configs.get("segment", False)
+    sam_predictor = None
+    if use_box_propt_sam and segment:
+        # A single FastSAM predictor is shared by all the models
+        sam_predictor = (
+            models.fastsam(configs.get("sam_imgsz", 1024))
+            if models is not None
+            else Inferencer.create_sam_predictor(configs.get("sam_imgsz", 1024))
+        )
+    # Settings of the inference shared by all the models
+    shared = dict(
+        segment=segment,
+        backend=options["backend"],
+        sam_predictor=sam_predictor,
+        minimize_points=configs.get("minimize_points", False),
+        use_box_propt_sam=use_box_propt_sam,
+        batch_size=batch_size,
+        contour_workers=configs.get("contour_workers", 4),
+        sam_imgsz=configs.get("sam_imgsz", 1024),
+        cache_dir=configs.get("cache_dir"),
+        cache_max_mb=configs.get("cache_max_mb", 2048),
+        cache_conf=configs.get("cache_conf", 0.05),
+        mask_format=configs.get("mask_format", "polygon"),
+        tile_size=configs.get("tile_size"),
+        tile_overlap=configs.get("tile_overlap", 0.2),
+        tile_merge_threshold=configs.get("tile_merge_threshold", 0.5),
+        # The images are decoded once for all the models, their cache keys record the same decode
+        reduced_decode=configs.get("reduced_decode", True),
+        profiler=profiler,
+    )
+
+    def route_settings(route):
+        return dict(
+            model_path=route["weights"],
+            model=(
+                models.yolo(route["weights"], options["backend"], route["imgsz"])
+                if models is not None
+                else None
+            ),
+            classes_list=list(route["names"]),
+            conf_dict=route["confs"],
+            conf=route["conf"],
+            imgsz=route["imgsz"],
+            iou=route["iou"],
+        )
+
+    # The other models run over the images decoded for the first one
+    other_models = [
+        (Inferencer(None, **route_settings(route), **shared), route["class_offset"])
+        for route in routes[1:]
+    ]
+
+    # Inference each photo
+    inferencer = Inferencer(
+        elements,
+        **route_settings(routes[0]),
+        **shared,
+        decode_workers=configs.get("decode_workers", 4),
+        prefetch_depth=configs.get("prefetch_depth", 16),
+        dedup_distance=configs.get("dedup_distance"),
+        frame_cache_dir=configs.get("frame_cache_dir"),
+        frame_cache_max_mb=configs.get("frame_cache_max_mb", 8192),
+        max_memory_mb=options["max_memory"],
+        routes=other_models,
+    )
+    elements = inferencer.stream()
+    if journal is not None:
+        # Replay the recorded results first, then checkpoint each new image as it finishes
+        elements = itertools.chain(journal.replay(), journal.record(elements))
+
+    # Stream the COCO JSON into the archive as the elements finish inference
+    converter = COCOConverter(elements, classes_cvat, classes_coco, profiler)
+
+    with ZipArchiver(result_folder + ".zip") as archive:
+        # The images are written without intermediate copies, the annotations are the last entry
+        if not video:
+            with profiler.stage("archive_images"):
+                archive.add_folder(
+                    input_folder, "images", include=lambda name: in_shard(name, shard)
+                )
+        with archive.open_text("annotations/instances_default.json") as output_file:
+            converter.write(output_file, previous)
+
+    # Print the path to the result archive in the terminal
+    print(f"Annotations are located at: {result_folder}.zip")
+
+    if profiler.enabled:
+        profiler.save(result_folder + ".profile.json")
+
+    if journal is not None:
+        # The export is complete, the checkpoint is no longer needed
+        journal.remove()
+
+    # Create a json for the CVAT project
+    if cvat_json:
+        generate_and_save_class_list(classes_cvat)
+
+
+def run_remote(options):
+    """
+    Annotates a CVAT task on a running annotation server and saves the archive locally.
+
+    Parameters:
+        options (dict): Values of the AutoCvat CLI options.
+
+    Returns:
+        None
+    """
+    if options["resume"]:
+        # The journal of a server job is removed with the job, there is nothing to resume from
+        raise click.ClickException("--resume is not supported with --server")
+    result_folder = options["annotations_zip"]
+    if options["save_photo"]:
+        save_photos(options["img_folder"])
+
+    # The server runs in another folder, local paths are made absolute
+    job_options = dict(options, server=None, save_photo=False, cvat_json=False)
+    for name in ("img_folder", "weights", "yaml_pth", "merge_with"):
+        if job_options[name] is not None and os.path.exists(job_options[name]):
+            job_options[name] = os.path.abspath(job_options[name])
+    try:
+        submit_job(options["server"], job_options, result_folder + ".zip")
+    except (OSError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    print(f"Annotations are located at: {result_folder}.zip")
+
+    if options["cvat_json"]:
+        with open(options["yaml_pth"], "r") as yaml_file:
+            configs = yaml.safe_load(yaml_file)
+        configs.update(parse_overrides(options["override"]))
+        routes = model_routes(configs, options["weights"], options["all_conf"])
+        generate_and_save_class_list(route_classes(routes)[0])
+
+
 @click.command()
 @click.option(
     "--img_folder",
     default="img_folder",
-    help="Folder with images (task from CVAT)",
+    help="Folder with images or a video file (task from CVAT)",
     type=str,
 )
 @click.option(
@@ -96,108 +513,84 @@ def generate_and_save_class_list(original_classes, file_name="new_classes.json")
     help="When set to True, it allows for zero-shot instance segmentation using SAM from any source detection network",
     type=bool,
 )
+@click.option(
+    "--batch_size",
+    default=None,
+    help="Number of images passed to the model in one call, overrides batch_size from config",
+    type=int,
+)
+@click.option(
+    "--resume",
+    default=False,
+    help="Checkpoint the results of each image to a journal and continue an interrupted run from it",
+    type=bool,
+)
+@click.option(
+    "--merge_with",
+    default=None,
+    help="Previous COCO export (zip archive or instances_default.json), only new images are annotated and merged into it",
+    type=str,
+)
+@click.option(
+    "--shard",
+    default=None,
+    help="Process only shard k of N of the image folder, given as k/N with k from 0 to N-1",
+    type=str,
+)
+@click.option(
+    "--local_shards",
+    default=None,
+    help="Split the task into N shards processed by parallel local processes and merge the results",
+    type=int,
+)
+@click.option(
+    "--frame_stride",
+    default=1,
+    help="Annotate only every N-th frame when img_folder is a video file",
+    type=int,
+)
+@click.option(
+    "--max_frames",
+    default=None,
+    help="Maximum number of annotated frames when img_folder is a video file",
+    type=int,
+)
+@click.option(
+    "--override",
+    multiple=True,
+    help="Override a value of the configuration file as KEY=VALUE, e.g. imgsz=1280, can be repeated",
+    type=str,
+)
+@click.option(
+    "--server",
+    default=None,
+    help="URL of a running AutoCvatServer (e.g. http://127.0.0.1:8765), the task is annotated there with warm models",
+    type=str,
+)
+@click.option(
+    "--backend",
+    default="torch",
+    help="Runtime of the model: torch, or onnx/openvino with the weights exported once and cached next to them",
+    type=click.Choice(["torch", "onnx", "openvino"]),
+)
+@click.option(
+    "--max_memory",
+    default=None,
+    help="Memory budget in MB, the batch size and prefetch depth adapt to it up to their configured values",
+    type=float,
+)
+@click.option(
+    "--profile",
+    default=False,
+    help="Measure the time and memory of each pipeline stage and save a JSON report next to the archive",
+    type=bool,
+)
 def main(**kwargs):
-    result_folder = kwargs["annotations_zip"]
-    model_pth = kwargs["weights"]
-    input_folder = kwargs["img_folder"]
-    configs = kwargs["yaml_pth"]
-    save_photo = bool(kwargs["save_photo"])
-    cvat_json = bool(kwargs["cvat_json"])
-    conf = kwargs["all_conf"]
-    use_box_propt_sam = kwargs["zero_shot_segmentation"]
-
-    # Load data from YAML file
-    with open(configs, "r") as yaml_file:
-        configs = yaml.safe_load(yaml_file)
-    # Get all keys and all values
-    classes_cvat = list(configs["names"].values())
-    classes_coco = list(configs["names"].keys())
-
-    if conf is not None:
-        dict_confs = {}
+    if kwargs["server"] is not None:
+        # Thin client: the models are already loaded by the server
+        run_remote(kwargs)
     else:
-        dict_confs = configs.get("confs", {})
-        if classes_coco != list(dict_confs):
-            raise LengthMismatchError(
-                "Class list and confidence threshold dictionary keys list do not match. "
-                "Each class must correspond to a confidence threshold."
-            )
-        min_value_conf = min((float(value) for value in dict_confs.values()))
-        conf = min_value_conf  # default conf as min conf of classes
-
-    # If the result folder already exists, delete it and create a new one
-    if os.path.exists(result_folder):
-        shutil.rmtree(result_folder)
-
-    # If the image upload folder exists, delete it and create a new one
-    if os.path.exists("images_for_cvat"):
-        shutil.rmtree("images_for_cvat")
-
-    # Create a result folder for annotations and images for uploading to cvat
-    os.mkdir(result_folder)
-    os.mkdir(result_folder + "/annotations")
-    os.mkdir(result_folder + "/images")
-
-    if save_photo:
-        os.mkdir("images_for_cvat")
-    # Get the list of files in the source folder
-    files = os.listdir(input_folder)
-    # Copy each file from the source folder to the target folder
-    for file_name in files:
-        source_file = os.path.join(input_folder, file_name)
-        destination_file = os.path.join(result_folder + "/images", file_name)
-        shutil.copy2(source_file, destination_file)  # Use shutil.copy2 to copy with metadata
-        if save_photo:
-            shutil.copy2(source_file, os.path.join("images_for_cvat", file_name))
-
-    if save_photo:
-        # Create a zip archive for uploading to CVAT
-        shutil.make_archive("images_for_cvat", "zip", "images_for_cvat")
-        # Delete the image folder for uploading to CVAT
-        shutil.rmtree("images_for_cvat")
-        print("Zip archive for uploading to CVAT: images_for_cvat.zip")
-
-    # Create a JSON string in COCO format
-    datagen = DataGen(input_folder)
-    elements = datagen.process()
-
-    # Inference each photo
-    inferencer = Inferencer(
-        elements,
-        segment=configs.get("segment", False),
-        model_path=model_pth,
-        classes_list=classes_coco,
-        conf_dict=dict_confs,
-        conf=conf,
-        imgsz=configs.get("imgsz", 640),
-        iou=configs.get("iou", 0.8),
-        minimize_points=configs.get("minimize_points", False),
-        use_box_propt_sam=use_box_propt_sam,
-    )
-    elements = inferencer.process()
-
-    # Create a JSON object
-    converter = COCOConverter(elements, classes_cvat, classes_coco)
-    results = converter.convert_to_coco()
-
-    # Write JSON to file
-    output_file_path = os.path.join(result_folder + "/annotations", "instances_default.json")
-
-    with open(output_file_path, "w") as output_file:
-        output_file.write(results)
-
-    # Create a zip archive from the result folder
-    shutil.make_archive(result_folder, "zip", result_folder)
-
-    # Print the path to the result folder in the terminal
-    print(f"Annotations are located at: {result_folder}.zip")
-
-    # Delete the result folder
-    shutil.rmtree(result_folder)
-
-    # Create a json for the CVAT project
-    if cvat_json:
-        generate_and_save_class_list(classes_cvat)
+        run(kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+# Library for creating CLI (Command Line Interface) interfaces
+import click
+
+# Custom modules and classes
+from AutoCvat import run
+from nodes.Server import AnnotationServer
+
+
+@click.command()
+@click.option(
+    "--host",
+    default="127.0.0.1",
+    help="Address the annotation server listens on",
+    type=str,
+)
+@click.option(
+    "--port",
+    default=8765,
+    help="Port the annotation server listens on",
+    type=int,
+)
+@click.option(
+    "--work_dir",
+    default=None,
+    help="Folder for the archives of the jobs, a temporary folder by default",
+    type=str,
+)
+@click.option(
+    "--allowed_root",
+    default=None,
+    help="Folder the images, weights and configuration files of the jobs have to be in, required with a non-loopback --host",
+    type=str,
+)
+def main(**kwargs):
+    # The models are loaded by the first job that needs them and stay in memory
+    try:
+        server = AnnotationServer(
+            run, kwargs["host"], kwargs["port"], kwargs["work_dir"], kwargs["allowed_root"]
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import yaml
+
+# Library for creating CLI (Command Line Interface) interfaces
+import click
+
+# Custom modules and classes
+from nodes.Merger import merge_archives
+from AutoCvat import model_routes, route_classes
+
+
+@click.command()
+@click.option(
+    "--shards",
+    multiple=True,
+    required=True,
+    help="COCO CVAT annotation zip archive of a shard, repeat the option for every shard",
+    type=str,
+)
+@click.option(
+    "--annotations_zip",
+    default="annotations",
+    help="Name of the merged COCO CVAT annotation zip archive",
+    type=str,
+)
+@click.option(
+    "--yaml_pth",
+    default=None,
+    help="The configuration yaml file the shards were created with, keeps the category ids consistent",
+    type=str,
+)
+def main(**kwargs):
+    shard_zips = kwargs["shards"]
+    result_folder = kwargs["annotations_zip"]
+    configs = kwargs["yaml_pth"]
+
+    classes_cvat = classes_coco = None
+    if configs is not None:
+        # Load data from YAML file
+        with open(configs, "r") as yaml_file:
+            configs = yaml.safe_load(yaml_file)
+        # The class IDs of several models are shifted like in the annotation run
+        classes_cvat, classes_coco = route_classes(model_routes(configs, None))
+
+    merge_archives(shard_zips, result_folder + ".zip", classes_cvat, classes_coco)
+
+    # Print the path to the result archive in the terminal
+    print(f"Annotations are located at: {result_folder}.zip")
+
+
+if __name__ == "__main__":
+    main()
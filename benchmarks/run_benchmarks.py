@@ -0,0 +1,328 @@
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import platform
+import tempfile
+import numpy as np
+import cv2
+import torch
+
+# Library for creating CLI (Command Line Interface) interfaces
+import click
+
+# The benchmarks run from the benchmarks folder, the custom modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Custom modules and classes
+from nodes.Datagen import DataGen
+from nodes.Prefetcher import Prefetcher
+from nodes.Inference import Inferencer
+from nodes.AnnotMaker import COCOConverter, COCO_ARCNAME
+from nodes.Archiver import ZipArchiver
+from nodes.Profiler import Profiler
+
+
+class _FakeBoxes:
+    """Minimal stand-in for the ultralytics Boxes object."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+
+class _FakeMasks:
+    """Minimal stand-in for the ultralytics Masks object."""
+
+    def __init__(self, data, xy):
+        self.data = data
+        self.xy = xy
+
+
+class _FakeResults:
+    """Minimal stand-in for an ultralytics Results object."""
+
+    def __init__(self, boxes, masks):
+        self.boxes = boxes
+        self.masks = masks
+
+
+class FakeModel:
+    """Deterministic stub detector returning a controllable number of detections.
+
+    It mimics the part of the ultralytics YOLO predict API used by Inferencer: boxes as
+    xyxy/cls/conf tensors and, in segment mode, full resolution masks with their polygons.
+
+    Attributes:
+        detections (int): Number of detections per image.
+        segment (bool): Whether masks are returned.
+        num_classes (int): Detections are spread over the classes 0..num_classes-1.
+        seed (int): Seed of the random generator.
+    """
+
+    def __init__(self, detections=10, segment=False, num_classes=5, seed=0):
+        self.detections = detections
+        self.segment = segment
+        self.num_classes = num_classes
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, images, conf=0.0, **kwargs):
+        return [self._predict_image(image, conf) for image in images]
+
+    def _predict_image(self, image, conf):
+        height, width = image.shape[:2]
+        count = self.detections
+        centers = self.rng.uniform([0, 0], [width, height], size=(count, 2))
+        sizes = self.rng.uniform(0.02, 0.2, size=(count, 2)) * [width, height]
+        xyxy = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+        xyxy = xyxy.clip(0, [width, height, width, height]).astype(np.float32)
+        confs = self.rng.uniform(max(conf, 0.05), 1.0, size=count).astype(np.float32)
+        classes = self.rng.integers(0, self.num_classes, size=count).astype(np.float32)
+        boxes = _FakeBoxes(
+            torch.from_numpy(xyxy), torch.from_numpy(confs), torch.from_numpy(classes)
+        )
+
+        masks = None
+        if self.segment:
+            data = np.zeros((count, height, width), dtype=np.uint8)
+            polygons = []
+            for mask, (x1, y1, x2, y2) in zip(data, xyxy.astype(np.int64)):
+                center = ((x1 + x2) // 2, (y1 + y2) // 2)
+                axes = (max((x2 - x1) // 2, 1), max((y2 - y1) // 2, 1))
+                polygon = cv2.ellipse2Poly(center, axes, 0, 0, 360, 5)
+                cv2.fillPoly(mask, [polygon], 1)
+                polygons.append(polygon.astype(np.float32))
+            masks = _FakeMasks(torch.from_numpy(data), polygons)
+        return _FakeResults(boxes, masks)
+
+
+def make_images(folder, count, width, height, seed=0):
+    """
+    Generates a folder of synthetic JPEG images.
+
+    Parameters:
+        folder (str): Target folder.
+        count (int): Number of images.
+        width (int): Width of the images.
+        height (int): Height of the images.
+        seed (int, optional): Seed of the random generator. Defaults to 0.
+
+    Returns:
+        None
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    # Smooth noise compresses like a photo rather than like white noise
+    base = rng.integers(0, 256, size=(max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    for index in range(count):
+        image = cv2.resize(
+            np.roll(base, index, axis=1), (width, height), interpolation=cv2.INTER_CUBIC
+        )
+        cv2.imwrite(os.path.join(folder, f"image_{index:06d}.jpg"), image)
+
+
+def stage(seconds, images, detections=None):
+    """
+    Formats the measurements of a pipeline stage.
+
+    Parameters:
+        seconds (float): Wall time of the stage.
+        images (int): Number of processed images.
+        detections (int, optional): Number of processed detections. Defaults to None.
+
+    Returns:
+        dict: Wall time and throughput of the stage.
+    """
+    result = {"seconds": seconds, "images_per_sec": images / seconds if seconds > 0 else None}
+    if detections is not None:
+        result["detections_per_sec"] = detections / seconds if seconds > 0 else None
+    return result
+
+
+def run_scenario(work_dir, width, height, count, detections, segment, minimize_points, workers):
+    """
+    Runs the pipeline stages on one synthetic dataset with the stub detector.
+
+    Parameters:
+        work_dir (str): Temporary folder for the images and archives.
+        width (int): Width of the images.
+        height (int): Height of the images.
+        count (int): Number of images.
+        detections (int): Number of detections per image.
+        segment (bool): Whether the stub detector returns masks.
+        minimize_points (bool): Whether the masks are converted with minimize_contours.
+        workers (int): Number of decode and contour worker threads.
+
+    Returns:
+        dict: Per-stage measurements of the scenario.
+    """
+    img_folder = os.path.join(work_dir, f"images_{width}x{height}_{count}")
+    if not os.path.isdir(img_folder):
+        make_images(img_folder, count, width, height)
+
+    # DataGen decode through the prefetching workers
+    def decode(element):
+        decoded = element.load_image() is not None
+        element.release_image()
+        return decoded
+
+    start = time.perf_counter()
+    decoded = sum(Prefetcher(DataGen(img_folder).stream(), decode, workers))
+    decode_seconds = time.perf_counter() - start
+
+    # Inference with the stub detector, the profiler stages time post-processing and contours
+    num_classes = 5
+    model = FakeModel(detections, segment, num_classes)
+    profiler = Profiler()
+    inferencer = Inferencer(
+        DataGen(img_folder).stream(),
+        segment=segment,
+        model=model,
+        classes_list=list(range(num_classes)),
+        conf_dict={class_id: 0.3 for class_id in range(num_classes)},
+        conf=0.3,
+        minimize_points=minimize_points,
+        decode_workers=workers,
+        contour_workers=workers,
+        profiler=profiler,
+    )
+    start = time.perf_counter()
+    elements = inferencer.process()
+    inference_seconds = time.perf_counter() - start
+    kept = sum(len(element.bbox) for element in elements)
+    timings = {
+        name: profiler.stages.get(name, {}).get("seconds", 0.0)
+        for name in ("predict", "postprocess", "minimize_contours")
+    }
+
+    # COCOConverter serialization
+    converter = COCOConverter(
+        elements, [f"class_{i}" for i in range(num_classes)], list(range(num_classes))
+    )
+    start = time.perf_counter()
+    output = io.StringIO()
+    converter.write(output)
+    coco_seconds = time.perf_counter() - start
+
+    # Archive creation the same way main does it
+    zip_path = os.path.join(work_dir, "annotations.zip")
+    start = time.perf_counter()
+    with ZipArchiver(zip_path) as archive:
+        archive.add_folder(img_folder, "images")
+        with archive.open_text(COCO_ARCNAME) as output_file:
+            output_file.write(output.getvalue())
+    archive_seconds = time.perf_counter() - start
+    os.remove(zip_path)
+
+    return {
+        "width": width,
+        "height": height,
+        "images": count,
+        "detections_per_image": detections,
+        "segment": segment,
+        "minimize_points": minimize_points,
+        "kept_detections": kept,
+        "stages": {
+            "decode": stage(decode_seconds, decoded),
+            "inference_total": stage(inference_seconds, len(elements), kept),
+            "stub_predict": stage(timings["predict"], len(elements)),
+            # Contour minimization is timed as a part of the postprocessing stage
+            "postprocess": stage(
+                timings["postprocess"] - timings["minimize_contours"], len(elements), kept
+            ),
+            "minimize_contours": stage(timings["minimize_contours"], len(elements), kept),
+            "coco_converter": stage(coco_seconds, len(elements), kept),
+            "archive": stage(archive_seconds, count),
+        },
+    }
+
+
+def parse_sizes(value):
+    return [tuple(int(side) for side in size.split("x")) for size in value.split(",")]
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(",")]
+
+
+@click.command()
+@click.option(
+    "--resolutions",
+    default="640x480,1920x1080",
+    help="Comma separated image resolutions as WIDTHxHEIGHT",
+    type=str,
+)
+@click.option("--counts", default="50", help="Comma separated numbers of images", type=str)
+@click.option(
+    "--detections",
+    default="10,100",
+    help="Comma separated numbers of detections per image returned by the stub detector",
+    type=str,
+)
+@click.option("--segment", default=True, help="Benchmark segmentation besides detection", type=bool)
+@click.option("--workers", default=4, help="Number of decode and contour worker threads", type=int)
+@click.option(
+    "--output", default="benchmark_results.json", help="Path of the JSON report", type=str
+)
+def main(**kwargs):
+    resolutions = parse_sizes(kwargs["resolutions"])
+    counts = parse_ints(kwargs["counts"])
+    detections_list = parse_ints(kwargs["detections"])
+    modes = [(False, False)]
+    if kwargs["segment"]:
+        modes += [(True, False), (True, True)]
+
+    scenarios = []
+    work_dir = tempfile.mkdtemp(prefix="autocvat_bench_")
+    try:
+        for width, height in resolutions:
+            for count in counts:
+                for detections in detections_list:
+                    for segment, minimize_points in modes:
+                        result = run_scenario(
+                            work_dir,
+                            width,
+                            height,
+                            count,
+                            detections,
+                            segment,
+                            minimize_points,
+                            kwargs["workers"],
+                        )
+                        scenarios.append(result)
+                        mode = (
+                            "detect"
+                            if not segment
+                            else "segment+minimize" if minimize_points else "segment"
+                        )
+                        summary = ", ".join(
+                            f"{name} {values['images_per_sec']:.1f} img/s"
+                            for name, values in result["stages"].items()
+                            if values["images_per_sec"] is not None
+                        )
+                        print(f"{width}x{height} x{count}, {detections} det/img, {mode}: {summary}")
+    finally:
+        shutil.rmtree(work_dir)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "torch": torch.__version__,
+        },
+        "scenarios": scenarios,
+    }
+    with open(kwargs["output"], "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Benchmark results are located at: {kwargs['output']}")
+
+
+if __name__ == "__main__":
+    main()
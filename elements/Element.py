@@ -1,19 +1,202 @@
+import cv2
 import numpy as np
 
+# Flags of cv2.imread decoding an image downscaled by a factor, JPEG is scaled during the decode
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
 
 class Element:
-    # Class containing information about a specific crop
+    # Class containing information about a specific crop.
+    # Slots keep the per-image overhead small, the detections are stored in numpy arrays
+    __slots__ = (
+        "image_id",
+        "file_name",
+        "file_path",
+        "width",
+        "height",
+        "image",
+        "category_id",
+        "bbox",
+        "annotations_id",
+        "areas",
+        "iscrowd",
+        "mask_data",
+        "mask_offsets",
+        "mask_rle",
+        "cache_key",
+        "predictions",
+        "image_hash",
+        "sam_results",
+    )
+
     def __init__(
-        self, image: np.ndarray, image_id: int, file_name: str, width: float, height: float
+        self,
+        image: np.ndarray = None,
+        image_id: int = None,
+        file_name: str = None,
+        width: float = None,
+        height: float = None,
+        file_path: str = None,
     ) -> None:
         self.image_id = image_id
         self.file_name = file_name
+        self.file_path = file_path  # Path to the image on disk, used for lazy decoding
         self.width = width
         self.height = height
-        self.image = image  # Original image
-        self.category_id = None  # List of detected classes
-        self.bbox = None  # List of lists with xyxy box coordinates
-        self.detected_masks = []  # List of np arrays with masks in case of yolo-seg
-        self.annotations_id = None
-        self.areas = None  # List of areas of bbox/masks depending on the task
-        self.iscrowd = 0  # 0 | 1 object is not a group | group
+        self.image = image  # Original image (None until loaded in streaming mode)
+        self.category_id = None  # np array with the detected classes
+        self.bbox = None  # np array with shape (N, 4) with xywh box coordinates
+        self.annotations_id = None  # np array with the annotation ID of each detection
+        self.areas = None  # np array with areas of bbox/masks depending on the task
+        # 0 | 1 object is not a group | group, or np array with the flag of each detection
+        self.iscrowd = 0
+        # Masks of all detections in one flat array, the mask i is
+        # mask_data[mask_offsets[i]:mask_offsets[i + 1]], None without masks
+        self.mask_data = None
+        self.mask_offsets = None
+        self.mask_rle = False  # True for RLE counts, False for polygon coordinates
+        self.cache_key = None  # Key of the image in the prediction cache
+        self.predictions = None  # Raw predictions restored from the prediction cache
+        self.image_hash = None  # Perceptual hash of the image, used to find near-duplicate frames
+        self.sam_results = None  # FastSAM results of the image shared by several models
+
+    @property
+    def detected_masks(self):
+        """List of masks in COCO format: polygons as flat coordinate lists or RLE dicts."""
+        if self.mask_offsets is None:
+            return []
+        return [self.segmentation(index) for index in range(len(self.mask_offsets) - 1)]
+
+    @detected_masks.setter
+    def detected_masks(self, segments):
+        """Packs polygons or RLE dicts into the flat mask arrays."""
+        if not segments:
+            self.mask_data = None
+            self.mask_offsets = None
+            self.mask_rle = False
+            return
+        # Detections without a mask have an empty list among the RLE dicts
+        self.mask_rle = any(isinstance(segment, dict) for segment in segments)
+        if self.mask_rle:
+            segments = [
+                segment["counts"] if isinstance(segment, dict) else segment for segment in segments
+            ]
+        arrays = [np.asarray(segment) for segment in segments]
+        # Integer polygons stay integers, empty polygons do not change the type
+        dtypes = [array.dtype for array in arrays if array.size]
+        dtype = np.result_type(*dtypes) if dtypes else np.int64
+        self.mask_data = np.concatenate([array.astype(dtype).reshape(-1) for array in arrays])
+        self.mask_offsets = np.cumsum([0] + [array.size for array in arrays])
+
+    def segmentation(self, index):
+        """Returns the mask of a detection in COCO format.
+
+        Args:
+            index (int): Index of the detection.
+
+        Returns:
+            list | dict: Polygon as a flat list of coordinates or RLE dict with size and counts,
+                an empty list for a detection without a mask.
+        """
+        values = self.mask_data[self.mask_offsets[index] : self.mask_offsets[index + 1]]
+        if self.mask_rle and len(values):
+            return {"size": [self.height, self.width], "counts": values.tolist()}
+        return values.tolist()
+
+    def load_image(self, reduce=1, frame_cache=None):
+        """Decodes the image from file_path if it is not loaded yet.
+
+        Args:
+            reduce (int, optional): Downscale factor of the decoded image, 1, 2, 4 or 8. With a
+                reduced decode width and height must already hold the full resolution size, read
+                from the file header, they are only swapped if the image is rotated by its EXIF
+                orientation. Defaults to 1.
+            frame_cache (FrameCache, optional): Cache of decoded images, the image is then a
+                read-only memory-mapped array. Defaults to None.
+
+        Returns:
+            np.ndarray | None: Decoded BGR image or None if the file could not be read.
+        """
+        if self.image is None and self.file_path is not None:
+            key = frame_cache.key(self.file_path, reduce) if frame_cache is not None else None
+            if key is not None:
+                self.image = frame_cache.get(key)
+            if self.image is None:
+                self.image = cv2.imread(self.file_path, REDUCED_DECODE_FLAGS[reduce])
+                if self.image is not None and key is not None:
+                    frame_cache.put(key, self.image)
+            if self.image is not None:
+                height, width = self.image.shape[:2]
+                if reduce == 1:
+                    self.height, self.width = height, width
+                elif abs(width / height - self.height / self.width) < abs(
+                    width / height - self.width / self.height
+                ):
+                    # The header size is before the EXIF rotation applied by imread
+                    self.width, self.height = self.height, self.width
+        return self.image
+
+    def decode_scale(self):
+        """Returns the scale from the decoded image to the full resolution image.
+
+        Returns:
+            tuple: Scale of the x and y coordinates, (1.0, 1.0) for a full resolution decode.
+        """
+        height, width = self.image.shape[:2]
+        return self.width / width, self.height / height
+
+    def release_image(self):
+        """Drops the pixel data, only the metadata and detections are kept."""
+        self.image = None
+        self.sam_results = None
+
+    def to_dict(self):
+        """Serializes the metadata and inference results of the element.
+
+        Returns:
+            dict: JSON serializable representation without pixel data.
+        """
+        return {
+            "image_id": self.image_id,
+            "file_name": self.file_name,
+            "width": self.width,
+            "height": self.height,
+            "bbox": self.bbox.tolist(),
+            "category_id": self.category_id.tolist(),
+            "areas": self.areas.tolist(),
+            "detected_masks": self.detected_masks,
+            "iscrowd": (
+                self.iscrowd.tolist() if isinstance(self.iscrowd, np.ndarray) else self.iscrowd
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores an element serialized with to_dict.
+
+        Args:
+            data (dict): Serialized element.
+
+        Returns:
+            Element: Element with the inference results and without pixel data.
+        """
+        element = cls(
+            image_id=data["image_id"],
+            file_name=data["file_name"],
+            width=data["width"],
+            height=data["height"],
+        )
+        element.bbox = np.asarray(data["bbox"], dtype=np.float64).reshape(-1, 4)
+        element.category_id = np.asarray(data["category_id"], dtype=np.int64)
+        element.areas = np.asarray(data["areas"])
+        element.detected_masks = data["detected_masks"]
+        iscrowd = data["iscrowd"]
+        element.iscrowd = (
+            np.asarray(iscrowd, dtype=np.int64) if isinstance(iscrowd, list) else iscrowd
+        )
+        return element
@@ -1,110 +1,283 @@
+import io
 import json
+import shutil
+import zipfile
+import tempfile
 import numpy as np
 from collections import defaultdict
+from nodes.Profiler import NullProfiler
+
+# Location of the COCO JSON inside a CVAT annotations archive
+COCO_ARCNAME = "annotations/instances_default.json"
+
+
+def load_coco(path):
+    """Loads a COCO export from a JSON file or from a CVAT annotations zip archive.
+
+    Args:
+        path (str): Path to instances_default.json or to the zip archive containing it.
+
+    Returns:
+        dict: COCO data.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            with archive.open(COCO_ARCNAME) as file:
+                return json.load(file)
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def compress_rle(counts):
+    """Compresses RLE counts into the COCO string format used by pycocotools.
+
+    Counts are stored as differences to the count two positions before them, split into
+    5 bit chunks written as printable characters, so the string is several times shorter
+    than the JSON list of counts.
+
+    Args:
+        counts (list): Uncompressed RLE counts.
+
+    Returns:
+        str: Compressed RLE counts.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    values = counts.copy()
+    # Same as pycocotools, which starts the differences from the fourth count
+    values[3:] -= counts[1:-2]
+    # 5 bit chunks of every value, least significant first; 7 chunks cover any 32 bit count
+    shifts = 5 * np.arange(7)[:, None]
+    chunks = (values >> shifts) & 0x1F
+    rest = values >> (shifts + 5)
+    # A value ends at the first chunk after which only its sign extension remains
+    done = np.where(chunks & 0x10, rest == -1, rest == 0)
+    lengths = np.argmax(done, axis=0) + 1
+    used = np.arange(7)[:, None] < lengths
+    # Every chunk but the last one of a value carries the continuation bit
+    chunks |= (np.arange(7)[:, None] < lengths - 1) * 0x20
+    return (chunks.T[used.T] + 48).astype(np.uint8).tobytes().decode("ascii")
+
+
+def coco_header(categories):
+    """Creates the COCO fields preceding the images and annotations.
+
+    Args:
+        categories (list): COCO category entries.
+
+    Returns:
+        dict: COCO licenses, info and categories.
+    """
+    return {
+        "licenses": [{"name": "", "id": 0, "url": ""}],
+        "info": {
+            "contributor": "",
+            "date_created": "",
+            "description": "",
+            "url": "",
+            "version": "",
+            "year": "",
+        },
+        "categories": categories,
+    }
 
 
 class COCOConverter:
     """Class for converting detection data to COCO format (Common Objects in Context).
 
     Attributes:
-        elements (list): List of elements containing detection information.
+        elements (iterable): Elements containing detection information.
         category_names (list): List of object category names.
 
     Methods:
         __init__: Initializes the COCOConverter object.
+        categories: Creates the list of COCO categories.
         convert_to_coco: Converts the data to COCO format.
+        write: Streams the data in COCO format into a file.
     """
 
-    def __init__(self, elements, category_names, category_id):
+    def __init__(self, elements, category_names, category_id, profiler=None):
         """Initialization of the COCOConverter object.
 
         Args:
-            elements (list): List of elements containing detection information.
+            elements (iterable): Elements containing detection information, a list or a lazy
+                Inferencer stream.
             category_names (list): List of object category names.
+            profiler (Profiler, optional): Collects the serialization time. Defaults to None.
         """
         self.elements = elements
+        self.profiler = profiler if profiler is not None else NullProfiler()
         category_dict = defaultdict(list)
         for name, id_ in zip(category_names, category_id):
             category_dict[name].append(id_)
         self.category_dict = dict(category_dict)
+        # Lookup table from the detected class ID + 1 to the COCO category ID
+        self.category_lookup = {
+            id_ + 1: ids[0] + 1 for ids in self.category_dict.values() for id_ in ids
+        }
 
-    def convert_to_coco(self):
-        """Converts the data to COCO format.
+    def categories(self):
+        """Creates the list of COCO categories, classes with the same name share a category.
 
         Returns:
-            str: JSON string representing the data in COCO format.
+            list: COCO category entries.
         """
-        # Creating a list of categories
-        categories = [
+        return [
             {"id": self.category_dict[name][0] + 1, "name": name, "supercategory": ""}
             for name in self.category_dict
         ]
 
-        # Creating a list of images
-        images = [
-            {
-                "id": elem.image_id,
-                "width": elem.width,
-                "height": elem.height,
-                "file_name": elem.file_name,
-                "license": 0,
-                "flickr_url": "",
-                "coco_url": "",
-                "date_captured": 0,
-            }
-            for elem in self.elements
-        ]
+    def convert_to_coco(self):
+        """Converts the data to COCO format.
 
-        # Creating a list of annotations
-        annotations = []
-        annotation_id = 1
-        for elem in self.elements:
-
-            counter = 0
-            for bbox, area, category_id in zip(elem.bbox, elem.areas, elem.category_id):
-                annotation = {
-                    "id": annotation_id,
-                    "image_id": elem.image_id,
-                    "category_id": int(
-                        list(
-                            filter(
-                                lambda sublist: category_id - 1 in sublist,
-                                self.category_dict.values(),
-                            )
-                        )[0][0]
-                        + 1
-                    ),
-                    "segmentation": [],
-                    "bbox": bbox,
-                    "area": area,
-                    "iscrowd": elem.iscrowd,
-                }
-                if elem.detected_masks:
-                    annotation["segmentation"] = [list(elem.detected_masks[counter])]
-                    annotation["attributes"] = {"occluded": False}
-                else:
-                    annotation["attributes"] = {"occluded": False, "rotation": 0}
-                annotations.append(annotation)
-                annotation_id += 1
-                counter += 1
-
-        # Creating the COCO dictionary
-        coco_data = {
-            "licenses": [{"name": "", "id": 0, "url": ""}],
-            "info": {
-                "contributor": "",
-                "date_created": "",
-                "description": "",
-                "url": "",
-                "version": "",
-                "year": "",
-            },
-            "categories": categories,
-            "images": images,
-            "annotations": annotations,
+        Returns:
+            str: JSON string representing the data in COCO format.
+        """
+        output = io.StringIO()
+        self.write(output)
+        return output.getvalue()
+
+    def write(self, file, previous=None):
+        """Streams the data in COCO format into a text file object.
+
+        Annotations are written as soon as each element is available, the image entries are
+        spooled to a temporary file and appended at the end, so memory usage does not depend
+        on the size of the dataset.
+
+        Args:
+            file: Writable text file object, e.g. an opened output file or a zip entry.
+            previous (dict, optional): COCO data of a previous export to merge. Its images and
+                annotations are written first, categories are matched by name and the new
+                annotation IDs continue after the previous ones. Defaults to None.
+        """
+        header = coco_header(self.categories())
+        # Write the header without the closing brace and open the annotations list
+        file.write(json.dumps(header)[:-1] + ', "annotations": [')
+
+        with tempfile.SpooledTemporaryFile(max_size=1 << 24, mode="w+") as images_file:
+            images = _JSONListWriter(images_file)
+            annotations = _JSONListWriter(file)
+            annotation_id = 1
+
+            if previous is not None:
+                for image in previous["images"]:
+                    images.write(image)
+                for annotation in self._previous_annotations(previous):
+                    annotations.write(annotation)
+                    annotation_id = max(annotation_id, annotation["id"] + 1)
+
+            for elem in self.elements:
+                with self.profiler.stage("coco_write"):
+                    images.write(self._image(elem))
+                    for annotation in self._annotations(elem, annotation_id):
+                        annotations.write(annotation)
+                        annotation_id += 1
+
+            with self.profiler.stage("coco_write"):
+                # Close the annotations list and append the list of images
+                file.write('], "images": [')
+                images_file.seek(0)
+                shutil.copyfileobj(images_file, file)
+                file.write("]}")
+
+    def _previous_annotations(self, previous):
+        """Maps the annotations of a previous export onto the current categories.
+
+        Args:
+            previous (dict): COCO data of a previous export.
+
+        Yields:
+            dict: Annotation with the category ID of the current export.
+        """
+        # Previous category ID -> current category ID, matched by name
+        category_ids = {
+            category["id"]: self.category_dict[category["name"]][0] + 1
+            for category in previous["categories"]
+            if category["name"] in self.category_dict
         }
+        dropped = 0
+        for annotation in previous["annotations"]:
+            if annotation["category_id"] not in category_ids:
+                dropped += 1
+                continue
+            yield dict(annotation, category_id=category_ids[annotation["category_id"]])
+        if dropped:
+            print(
+                f"{dropped} previous annotations with categories missing in the config were dropped"
+            )
+
+    def _image(self, elem):
+        """Creates the COCO image entry of an element.
+
+        Args:
+            elem (Element): Element with image information.
+
+        Returns:
+            dict: COCO image entry.
+        """
+        return {
+            "id": elem.image_id,
+            "width": elem.width,
+            "height": elem.height,
+            "file_name": elem.file_name,
+            "license": 0,
+            "flickr_url": "",
+            "coco_url": "",
+            "date_captured": 0,
+        }
+
+    def _annotations(self, elem, annotation_id):
+        """Creates the COCO annotations of an element.
+
+        Args:
+            elem (Element): Element with detection information.
+            annotation_id (int): ID of the first annotation of the element.
+
+        Yields:
+            dict: COCO annotation entry.
+        """
+        # The detections are serialized straight from the element arrays
+        offsets = elem.mask_offsets.tolist() if elem.mask_offsets is not None else None
+        # The crowd flag is per detection when the detections of several models are merged
+        if isinstance(elem.iscrowd, np.ndarray):
+            iscrowd = elem.iscrowd.tolist()
+        else:
+            iscrowd = [elem.iscrowd] * len(elem.bbox)
+        for counter, (bbox, area, category_id) in enumerate(
+            zip(elem.bbox.tolist(), elem.areas.tolist(), elem.category_id.tolist())
+        ):
+            annotation = {
+                "id": annotation_id + counter,
+                "image_id": elem.image_id,
+                "category_id": int(self.category_lookup[category_id]),
+                "segmentation": [],
+                "bbox": bbox,
+                "area": area,
+                "iscrowd": iscrowd[counter],
+            }
+            if offsets is not None and offsets[counter + 1] > offsets[counter]:
+                values = elem.mask_data[offsets[counter] : offsets[counter + 1]]
+                if elem.mask_rle:
+                    # RLE mask, the counts are written in the compact COCO string format
+                    annotation["segmentation"] = {
+                        "size": [elem.height, elem.width],
+                        "counts": compress_rle(values),
+                    }
+                else:
+                    annotation["segmentation"] = [values.tolist()]
+                annotation["attributes"] = {"occluded": False}
+            else:
+                # Detections without a mask are plain boxes
+                annotation["attributes"] = {"occluded": False, "rotation": 0}
+            yield annotation
+
+
+class _JSONListWriter:
+    """Helper writing the items of a JSON list one by one, with separators between them."""
 
-        # Convert to JSON string
-        coco_json = json.dumps(coco_data)
+    def __init__(self, file):
+        self.file = file
+        self.empty = True
 
-        return coco_json
+    def write(self, item):
+        self.file.write(("" if self.empty else ", ") + json.dumps(item))
+        self.empty = False
@@ -0,0 +1,133 @@
+import io
+import os
+import time
+import shutil
+import zipfile
+
+# Already compressed formats are stored in the archive without recompression
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ZipArchiver:
+    """Class for writing zip archives straight from the source files.
+
+    Files are streamed into the archive without intermediate copies, images are stored
+    as is and everything else is deflated. Text entries such as the COCO JSON can be
+    streamed into the archive through open_text. The archive is written to a temporary file
+    next to zip_path that replaces it only when the archive is closed without an error, so a
+    failed run keeps the previous archive, e.g. the one given with --merge_with.
+
+    Attributes:
+        zip_path (str): Path of the created zip archive.
+        tmp_path (str): Path of the archive while it is written.
+    """
+
+    def __init__(self, zip_path):
+        """Initialization of the ZipArchiver object.
+
+        Args:
+            zip_path (str): Path of the created zip archive, an existing file is replaced once
+                the archive is complete.
+        """
+        self.zip_path = zip_path
+        self.tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+        self.zip_file = zipfile.ZipFile(
+            self.tmp_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_file(self, file_path, arcname):
+        """Streams a file from disk into the archive.
+
+        Args:
+            file_path (str): Path to the source file.
+            arcname (str): Name of the entry in the archive.
+        """
+        if arcname.lower().endswith(STORED_EXTENSIONS):
+            compress_type = zipfile.ZIP_STORED
+        else:
+            compress_type = zipfile.ZIP_DEFLATED
+        self.zip_file.write(file_path, arcname, compress_type=compress_type)
+
+    def add_folder(self, folder_path, arc_folder="", include=None):
+        """Streams all files of a folder (without subfolders) into the archive.
+
+        Args:
+            folder_path (str): Path to the source folder.
+            arc_folder (str, optional): Folder of the entries in the archive. Defaults to the root.
+            include (callable, optional): Predicate on the file name selecting the files to add.
+                Defaults to all files.
+        """
+        for file_name in os.listdir(folder_path):
+            file_path = os.path.join(folder_path, file_name)
+            if os.path.isfile(file_path) and (include is None or include(file_name)):
+                self.add_file(file_path, f"{arc_folder}/{file_name}" if arc_folder else file_name)
+
+    def copy_entries(self, zip_path, prefix, skip=()):
+        """Copies entries from another zip archive, images stay uncompressed.
+
+        Args:
+            zip_path (str): Path to the source zip archive.
+            prefix (str): Only the entries whose name starts with the prefix are copied.
+            skip (set, optional): Entry names already in the archive. Defaults to none.
+
+        Returns:
+            set: Names of the copied entries.
+        """
+        copied = set()
+        with zipfile.ZipFile(zip_path) as source:
+            for info in source.infolist():
+                if info.is_dir() or not info.filename.startswith(prefix) or info.filename in skip:
+                    continue
+                zip_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                zip_info.compress_type = info.compress_type
+                with source.open(info) as src:
+                    with self.zip_file.open(zip_info, "w", force_zip64=True) as dst:
+                        shutil.copyfileobj(src, dst, 1 << 20)
+                copied.add(info.filename)
+        return copied
+
+    def open_text(self, arcname):
+        """Opens a deflated text entry for streaming writes.
+
+        Only one entry can be written at a time, so it has to be closed before adding other files.
+
+        Args:
+            arcname (str): Name of the entry in the archive.
+
+        Returns:
+            io.TextIOWrapper: Writable text file object.
+        """
+        zip_info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+        zip_info.compress_type = zipfile.ZIP_DEFLATED
+        return io.TextIOWrapper(
+            self.zip_file.open(zip_info, "w", force_zip64=True), encoding="utf-8"
+        )
+
+    def close(self):
+        """Writes the central directory and moves the archive to zip_path."""
+        try:
+            self.zip_file.close()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self.tmp_path, self.zip_path)
+
+    def abort(self):
+        """Closes the archive and deletes it, zip_path is left untouched."""
+        try:
+            self.zip_file.close()
+        except Exception:
+            # An entry still open for writing prevents closing the archive the usual way
+            if self.zip_file.fp is not None:
+                self.zip_file.fp.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
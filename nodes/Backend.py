@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from nodes.Cache import file_hash
+
+# Runtimes the weights can be exported to, torch runs the weights as they are
+BACKENDS = ("torch", "onnx", "openvino")
+
+
+def load_model(model_path, backend="torch", imgsz=640):
+    """Loads a YOLO model, exporting the weights to another runtime first if needed.
+
+    The exported model is cached next to the weights in a <weights>.exports folder, keyed by
+    the hash of the weights and the export settings, so the export only runs once. A cache
+    entry is complete once its info.json is written. Processes loading the same weights at
+    once, e.g. local shards, export them once under a lock file and share the result.
+
+    Args:
+        model_path (str): Path to the .pt weights.
+        backend (str, optional): "torch", "onnx" or "openvino". Defaults to "torch".
+        imgsz (int, optional): Input image size the model is exported for. Defaults to 640.
+
+    Returns:
+        YOLO: Loaded model.
+    """
+    from ultralytics import YOLO, __version__
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, got '{backend}'")
+    if backend == "torch":
+        return YOLO(model_path)
+    if not os.path.isfile(model_path):
+        # Named models are downloaded by ultralytics on first use
+        model_path = YOLO(model_path).ckpt_path
+
+    settings = {"backend": backend, "imgsz": imgsz, "ultralytics": __version__}
+    key = hashlib.sha256(
+        (file_hash(model_path) + json.dumps(settings, sort_keys=True)).encode()
+    ).hexdigest()[:16]
+    exports_dir = f"{model_path}.exports"
+    export_dir = os.path.join(exports_dir, f"{backend}-{key}")
+    info_path = os.path.join(export_dir, "info.json")
+
+    if not os.path.exists(info_path):
+        os.makedirs(exports_dir, exist_ok=True)
+        lock_path = f"{export_dir}.lock"
+        # Shard processes starting together export once, the others wait for the result
+        if _acquire_lock(lock_path, info_path):
+            try:
+                if not os.path.exists(info_path):
+                    _export(model_path, backend, imgsz, settings, exports_dir, export_dir)
+            finally:
+                os.remove(lock_path)
+
+    with open(info_path, "r") as file:
+        info = json.load(file)
+    return YOLO(os.path.join(export_dir, info["artifact"]), task=info["task"])
+
+
+def _export(model_path, backend, imgsz, settings, exports_dir, export_dir):
+    """Exports the weights and publishes the exported model in export_dir.
+
+    The export runs on a copy of the weights in a temporary folder, so the files ultralytics
+    writes next to the weights do not touch the files of the user. The folder with the model
+    and its info.json is moved to export_dir in a single rename.
+
+    Args:
+        model_path (str): Path to the .pt weights.
+        backend (str): "onnx" or "openvino".
+        imgsz (int): Input image size the model is exported for.
+        settings (dict): Export settings stored in info.json.
+        exports_dir (str): Folder with the exports of the weights.
+        export_dir (str): Folder the exported model is published to.
+    """
+    from ultralytics import YOLO
+
+    print(f"Exporting {model_path} to {backend}, it is done once for these settings")
+    tmp_dir = tempfile.mkdtemp(prefix=f"tmp-{os.getpid()}-", dir=exports_dir)
+    try:
+        weights = os.path.join(tmp_dir, os.path.basename(model_path))
+        shutil.copyfile(model_path, weights)
+        model = YOLO(weights)
+        # Dynamic axes let the exported model take batches of any size
+        exported = model.export(format=backend, imgsz=imgsz, dynamic=True, verbose=False)
+        publish_dir = os.path.join(tmp_dir, "publish")
+        os.makedirs(publish_dir)
+        # The OpenVINO loader recognizes the model folder by its suffix
+        artifact = os.path.basename(os.path.normpath(exported))
+        os.replace(exported, os.path.join(publish_dir, artifact))
+        with open(os.path.join(publish_dir, "info.json"), "w") as file:
+            json.dump(dict(settings, task=model.task, artifact=artifact), file)
+        if os.path.isdir(export_dir):
+            # Left over by an export that did not finish
+            shutil.rmtree(export_dir)
+        os.replace(publish_dir, export_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _acquire_lock(lock_path, info_path, poll_interval=0.5, stale_seconds=3600):
+    """Takes the lock of an export, or waits until another process has published it.
+
+    Args:
+        lock_path (str): Path of the lock file.
+        info_path (str): Path of the info.json of the export.
+        poll_interval (float, optional): Seconds between checks. Defaults to 0.5.
+        stale_seconds (float, optional): Age after which the lock of a process that died during
+            the export is removed. Defaults to 3600.
+
+    Returns:
+        bool: True if the lock was taken, False if the export was published meanwhile.
+    """
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if os.path.exists(info_path):
+                return False
+            try:
+                if time.time() - os.path.getmtime(lock_path) > stale_seconds:
+                    os.remove(lock_path)
+            except OSError:
+                # Released in the meantime
+                pass
+            time.sleep(poll_interval)
+            continue
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return True
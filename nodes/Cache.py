@@ -0,0 +1,386 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """Computes the SHA-256 hash of a file content.
+
+    Args:
+        file_path (str): Path to the file.
+        chunk_size (int, optional): Size of the chunks read from disk. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    """Class for an on-disk, content-addressed cache of raw model predictions.
+
+    Each entry is a .npz file named after the hash of the image content and of the settings
+    that influence the raw predictions (weights file, imgsz, iou, segmentation mode...).
+    Confidence thresholds are not part of the key: the predictions are stored at a low
+    confidence floor and filtered after loading. The least recently used entries are
+    evicted when the cache grows over its size limit.
+
+    Attributes:
+        cache_dir (str): Folder with the cache entries.
+        max_size (int): Size limit of the cache in bytes.
+        settings_hash (str): Hash of the settings shared by all entries of a run.
+    """
+
+    def __init__(self, cache_dir, settings, max_size_mb=2048):
+        """Initialization of the PredictionCache object.
+
+        Args:
+            cache_dir (str): Folder with the cache entries, created if it does not exist.
+            settings (dict): JSON serializable settings that influence the raw predictions.
+            max_size_mb (float, optional): Size limit of the cache in megabytes. Defaults to 2048.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.settings_hash = hashlib.sha256(
+            json.dumps(settings, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._stats())
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file_path):
+        """Builds the cache key of an image.
+
+        Args:
+            file_path (str): Path to the image.
+
+        Returns:
+            str: Cache key combining the image content hash and the settings hash.
+        """
+        return hashlib.sha256((file_hash(file_path) + self.settings_hash).encode()).hexdigest()
+
+    def get(self, key, min_conf):
+        """Loads the raw predictions of an image.
+
+        Args:
+            key (str): Cache key of the image.
+            min_conf (float): Confidence threshold the predictions will be filtered with, entries
+                stored at a higher floor can not serve it.
+
+        Returns:
+            dict | None: Raw predictions or None on a cache miss.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                if float(data["conf_floor"]) > min_conf:
+                    record = None
+                else:
+                    record = self._unpack(data)
+        except (OSError, KeyError, ValueError):
+            record = None
+
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return record
+
+    def put(self, key, record):
+        """Stores the raw predictions of an image and evicts old entries if needed.
+
+        Args:
+            key (str): Cache key of the image.
+            record (dict): Raw predictions with xyxy, confs, classes, segments, width, height and
+                conf_floor, and the tile_ids and mask rois of unmerged tile predictions.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                np.savez(file, **self._pack(record))
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            # A full or read-only cache folder only disables caching of these predictions
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits 90% of its limit."""
+        entries = sorted(self._stats())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def _entries(self):
+        """Lists the cache entries.
+
+        Returns:
+            list: os.DirEntry objects of the .npz files in the cache folder.
+        """
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npz")]
+
+    def _stats(self):
+        """Reads the modification time and size of the cache entries.
+
+        Returns:
+            list: (mtime, size, path) of each entry still in the cache folder.
+        """
+        stats = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Removed by another process in the meantime
+                continue
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+        return stats
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    @staticmethod
+    def _pack(record):
+        """Converts raw predictions into flat arrays storable with np.savez.
+
+        Args:
+            record (dict): Raw predictions.
+
+        Returns:
+            dict: Arrays to store.
+        """
+        arrays = {
+            "xyxy": record["xyxy"],
+            "confs": record["confs"],
+            "classes": record["classes"],
+            "width": np.array(record["width"]),
+            "height": np.array(record["height"]),
+            "conf_floor": np.array(record["conf_floor"]),
+        }
+        segments = record["segments"]
+        if segments and isinstance(segments[0], dict):
+            # RLE masks all have the image size, only their counts are stored
+            arrays["segment_rle"] = np.array(True)
+            segments = [segment["counts"] for segment in segments]
+        if segments is not None:
+            # Polygons have different lengths, they are stored as one flat array with offsets
+            lengths = [len(segment) for segment in segments]
+            arrays["segment_offsets"] = np.cumsum([0] + lengths)
+            arrays["segment_points"] = np.array(
+                [point for segment in segments for point in segment]
+            )
+        if record.get("tile_ids") is not None:
+            # Unmerged tile predictions, merged after filtering
+            arrays["tile_ids"] = record["tile_ids"]
+        if record.get("rois") is not None:
+            # Binary mask regions are stored as one bit array with their offsets and shapes
+            arrays["roi_boxes"] = np.array(
+                [[x0, y0, *mask.shape] for mask, x0, y0 in record["rois"]], dtype=np.int64
+            ).reshape(-1, 4)
+            bits = [np.zeros(0, dtype=bool)] + [mask.reshape(-1) for mask, _, _ in record["rois"]]
+            arrays["roi_bits"] = np.packbits(np.concatenate(bits))
+        return arrays
+
+    @staticmethod
+    def _unpack(data):
+        """Restores raw predictions from the stored arrays.
+
+        Args:
+            data (NpzFile): Stored arrays.
+
+        Returns:
+            dict: Raw predictions.
+        """
+        segments = None
+        if "segment_offsets" in data:
+            offsets = data["segment_offsets"]
+            points = data["segment_points"].tolist()
+            segments = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            if "segment_rle" in data:
+                size = [int(data["height"]), int(data["width"])]
+                segments = [{"size": size, "counts": counts} for counts in segments]
+        rois = None
+        if "roi_boxes" in data:
+            boxes = data["roi_boxes"]
+            sizes = boxes[:, 2] * boxes[:, 3]
+            bits = np.unpackbits(data["roi_bits"], count=int(sizes.sum())).astype(bool)
+            ends = np.cumsum(sizes)
+            rois = [
+                (bits[end - size : end].reshape(height, width), int(x0), int(y0))
+                for (x0, y0, height, width), size, end in zip(boxes, sizes, ends)
+            ]
+        return {
+            "xyxy": data["xyxy"],
+            "confs": data["confs"],
+            "classes": data["classes"],
+            "segments": segments,
+            "tile_ids": data["tile_ids"] if "tile_ids" in data else None,
+            "rois": rois,
+            "width": int(data["width"]),
+            "height": int(data["height"]),
+            "conf_floor": float(data["conf_floor"]),
+        }
+
+
+class FrameCache:
+    """Class for an on-disk cache of decoded images stored as memory-mapped numpy arrays.
+
+    Each entry is a .npy file with the decoded BGR pixels of an image, named after the image
+    path, modification time, file size and decode scale, so a modified image is decoded again.
+    Entries are opened with mmap, the pixels are read lazily from the page cache and shared
+    by all the runs and processes using the same image. The least recently used entries are
+    evicted when the cache grows over its size limit.
+
+    Attributes:
+        cache_dir (str): Folder with the cache entries.
+        max_size (int): Size limit of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=8192):
+        """Initialization of the FrameCache object.
+
+        Args:
+            cache_dir (str): Folder with the cache entries, created if it does not exist.
+            max_size_mb (float, optional): Size limit of the cache in megabytes. Defaults to 8192.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Measures the cache and enforces the size limit, a run where every image is a hit
+        # never stores an entry
+        self._size = 0
+        self._evict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, file_path, reduce=1):
+        """Builds the cache key of an image without reading its content.
+
+        Args:
+            file_path (str): Path to the image.
+            reduce (int, optional): Downscale factor of the decoded image. Defaults to 1.
+
+        Returns:
+            str | None: Cache key, None if the file does not exist.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        source = [os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size, reduce]
+        return hashlib.sha256(json.dumps(source).encode()).hexdigest()
+
+    def get(self, key):
+        """Opens the decoded image of an entry.
+
+        Args:
+            key (str): Cache key of the image.
+
+        Returns:
+            np.memmap | None: Read-only view of the pixels mapped from the entry, or None on a
+                cache miss.
+        """
+        path = self._path(key)
+        try:
+            image = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            image = None
+
+        with self._lock:
+            if image is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def put(self, key, image):
+        """Stores a decoded image and evicts old entries if needed.
+
+        Args:
+            key (str): Cache key of the image.
+            image (np.ndarray): Decoded image.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                np.save(file, image)
+            # Readers in other processes see either no entry or a complete one
+            os.replace(tmp_path, path)
+        except OSError:
+            # A full or read-only cache folder only disables caching of this image
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits 90% of its limit.
+
+        Entries mapped by other processes stay readable by them after the removal.
+        """
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except OSError:
+                # Removed by another process in the meantime
+                pass
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+    def _entries(self):
+        """Lists the cache entries.
+
+        Returns:
+            list: os.DirEntry objects of the .npy files in the cache folder.
+        """
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".npy")]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
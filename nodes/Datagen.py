@@ -1,23 +1,125 @@
 import os
+import zlib
+import struct
 import cv2
 from elements.Element import Element
 
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm", ".mpg", ".mpeg", ".wmv", ".m4v")
+
+
+def is_video(path):
+    """Checks whether a path points to a video file.
+
+    Args:
+        path (str): Path to a folder or a file.
+
+    Returns:
+        bool: True if the path is a video file.
+    """
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+# JPEG start of frame markers holding the image size, DHT, JPG and DAC markers are excluded
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def image_size(path):
+    """Reads the size of a JPEG or PNG image from its header, without decoding the pixels.
+
+    The size is the one stored in the file, before any EXIF rotation.
+
+    Args:
+        path (str): Path to the image.
+
+    Returns:
+        tuple | None: Width and height of the image, None for other formats or broken headers.
+    """
+    try:
+        with open(path, "rb") as file:
+            head = file.read(24)
+            if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if head[:2] != b"\xff\xd8":
+                return None
+            file.seek(2)
+            # Walk the marker segments up to the start of frame, skipping EXIF and other metadata
+            while True:
+                marker = file.read(2)
+                while marker[:1] == b"\xff" and marker[1:] == b"\xff":
+                    # Fill bytes before a marker
+                    marker = marker[1:] + file.read(1)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] == 0x01 or 0xD0 <= marker[1] <= 0xD7:
+                    # Markers without a segment
+                    continue
+                (length,) = struct.unpack(">H", file.read(2))
+                if marker[1] in JPEG_SOF_MARKERS:
+                    height, width = struct.unpack(">xHH", file.read(5))
+                    return (width, height) if width and height else None
+                if marker[1] == 0xDA or length < 2:
+                    # Start of scan without a frame header
+                    return None
+                file.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def frame_name(frame):
+    """Builds the file name CVAT gives to a frame of a video task.
+
+    Args:
+        frame (int): Index of the frame in the video, starting from 0.
+
+    Returns:
+        str: File name of the frame.
+    """
+    return f"frame_{frame:06d}.PNG"
+
+
+def in_shard(file_name, shard):
+    """Checks whether a file belongs to a shard.
+
+    Files are assigned by a stable hash of their name, so every worker computes the same
+    disjoint split of the folder regardless of the listing order.
+
+    Args:
+        file_name (str): Name of the file.
+        shard (tuple | None): Shard index k and number of shards N, None means no sharding.
+
+    Returns:
+        bool: True if the file belongs to the shard.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(file_name.encode("utf-8")) % count == index
+
 
 class DataGen:
     """Class for generating image data.
 
     Attributes:
-        folder_path (str): Path to the folder with images.
+        folder_path (str): Path to the folder with images or to a video file.
+        frame_stride (int): Only every frame_stride-th frame of a video is annotated.
+        max_frames (int | None): Maximum number of annotated frames of a video.
     """
 
-    def __init__(self, folder_path):
+    def __init__(self, folder_path, frame_stride=1, max_frames=None):
         """Initialization of the DataGen object.
 
         Args:
-            folder_path (str): Path to the folder with images.
+            folder_path (str): Path to the folder with images or to a video file.
+            frame_stride (int, optional): Only every frame_stride-th frame of a video is
+                annotated. Defaults to 1.
+            max_frames (int, optional): Maximum number of annotated frames of a video, None
+                reads the whole video. Defaults to None.
         """
         # Check if the folder exists
         self.folder_path = folder_path
+        self.frame_stride = max(1, int(frame_stride))
+        self.max_frames = max_frames
 
     def process(self):
         """Processing images in the folder and creating elements.
@@ -35,7 +137,7 @@ class DataGen:
             file_parh = os.path.join(self.folder_path, filename)
             # Check if the file is an image
             if os.path.isfile(file_parh) and any(
-                filename.lower().endswith(ext) for ext in [".jpg", ".jpeg", ".png"]
+                filename.lower().endswith(ext) for ext in IMAGE_EXTENSIONS
             ):
                 try:
                     # Read the image
@@ -58,3 +160,102 @@ class DataGen:
                     print(f"Error processing file '{filename}': {e}")
 
         return data_all_elements
+
+    def stream(self, skip=(), exclude=(), start_id=None, shard=None):
+        """Lazily yields elements for the images in the folder.
+
+        Unlike process, no image is decoded here: each Element only keeps the path
+        and metadata, the pixel data is read with Element.load_image when it is needed.
+        A video is decoded frame by frame instead, see stream_video.
+
+        Args:
+            skip (set, optional): File names of images to leave out, e.g. already annotated ones.
+                They still count in the numbering of the images.
+            exclude (set, optional): File names of images to leave out of the numbering as well,
+                e.g. images of a previous export.
+            start_id (int, optional): When given, the images are numbered from start_id in file
+                name order instead of by their position in the folder listing. Defaults to None.
+            shard (tuple, optional): Shard index k and number of shards N, only the images of
+                the shard are yielded while the numbering stays global. Defaults to None.
+
+        Yields:
+            Element: Element object with the image path and id.
+        """
+        if is_video(self.folder_path):
+            yield from self.stream_video(skip, exclude, shard)
+            return
+        if not os.path.isdir(self.folder_path):
+            print(f'Folder "{self.folder_path}" does not exist')
+            return
+
+        file_names = os.listdir(self.folder_path)
+        if start_id is not None:
+            # Only the images are numbered, in a stable order
+            file_names = sorted(
+                filename
+                for filename in file_names
+                if filename not in exclude and filename.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        first_id = 1 if start_id is None else start_id
+
+        for num, filename in enumerate(file_names, start=first_id):
+            file_path = os.path.join(self.folder_path, filename)
+            if filename in skip or filename in exclude or not in_shard(filename, shard):
+                continue
+            # Check if the file is an image
+            if os.path.isfile(file_path) and filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield Element(image_id=num, file_name=filename, file_path=file_path)
+
+    def stream_video(self, skip=(), exclude=(), shard=None):
+        """Lazily yields elements for the frames of a video file.
+
+        The frames are named and numbered the way CVAT does for video tasks, so the export
+        can be imported into a task created from the same video. Frames that are not annotated
+        are only grabbed from the stream, without being retrieved and converted.
+
+        Args:
+            skip (set, optional): File names of frames to leave out, e.g. already annotated ones.
+            exclude (set, optional): File names of frames to leave out, e.g. frames of a
+                previous export.
+            shard (tuple, optional): Shard index k and number of shards N, only the frames of
+                the shard are yielded. Defaults to None.
+
+        Yields:
+            Element: Element object with the decoded frame.
+        """
+        capture = cv2.VideoCapture(self.folder_path)
+        if not capture.isOpened():
+            print(f'Video "{self.folder_path}" can not be opened')
+            return
+
+        try:
+            frame = 0
+            annotated = 0
+            while self.max_frames is None or annotated < self.max_frames:
+                if not capture.grab():
+                    break
+                filename = frame_name(frame)
+                selected = frame % self.frame_stride == 0
+                if selected:
+                    annotated += 1
+                if (
+                    selected
+                    and filename not in skip
+                    and filename not in exclude
+                    and in_shard(filename, shard)
+                ):
+                    retrieved, img = capture.retrieve()
+                    if retrieved:
+                        height, width = img.shape[:2]
+                        yield Element(
+                            image=img,
+                            image_id=frame + 1,
+                            file_name=filename,
+                            width=width,
+                            height=height,
+                        )
+                    else:
+                        print(f"Error processing frame {frame} of '{self.folder_path}'")
+                frame += 1
+        finally:
+            capture.release()
@@ -0,0 +1,89 @@
+from collections import deque
+import cv2
+import numpy as np
+
+
+def dhash(image, size=8):
+    """Computes the difference hash of an image.
+
+    The image is shrunk to (size + 1) x size gray pixels and every bit tells whether a pixel
+    is brighter than its right neighbour, so the hash does not change with small noise,
+    compression artifacts or the resolution of the image.
+
+    Args:
+        image (np.ndarray): BGR or gray image.
+        size (int, optional): Number of rows and bits per row of the hash. Defaults to 8.
+
+    Returns:
+        int: Hash with size * size bits.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+class FrameDeduplicator:
+    """Class for finding near-duplicate frames whose detections can be reused.
+
+    Every frame that goes through the model becomes a reference. A frame of the same size whose
+    hash is within max_distance bits of a recent reference is a duplicate of it. Duplicates are
+    only compared with references, so a slow drift of the scene always ends in a new inference.
+
+    Attributes:
+        max_distance (int): Maximum Hamming distance between the hashes of duplicate frames.
+        references (deque): Hash, size and element of the most recent references.
+        duplicates (int): Number of frames found to be duplicates.
+        frames (int): Number of frames checked.
+    """
+
+    def __init__(self, max_distance=4, window=32):
+        """Initialization of the FrameDeduplicator object.
+
+        Args:
+            max_distance (int, optional): Maximum Hamming distance between the hashes of
+                duplicate frames. Defaults to 4.
+            window (int, optional): Number of recent references a frame is compared with.
+                Defaults to 32.
+        """
+        self.max_distance = int(max_distance)
+        self.references = deque(maxlen=max(1, int(window)))
+        self.duplicates = 0
+        self.frames = 0
+
+    def find(self, element, image_hash):
+        """Finds the reference a frame is a duplicate of, or makes the frame a new reference.
+
+        Args:
+            element (Element): Frame to check, with its full resolution width and height.
+            image_hash (int): dHash of the frame.
+
+        Returns:
+            Element | None: Reference element with the closest hash, None if the frame has to
+                go through the model.
+        """
+        self.frames += 1
+        size = (element.width, element.height)
+        best, best_distance = None, self.max_distance + 1
+        # The most recent references are the most likely matches
+        for reference_hash, reference_size, reference in reversed(self.references):
+            distance = bin(reference_hash ^ image_hash).count("1")
+            if reference_size == size and distance < best_distance:
+                best, best_distance = reference, distance
+                if distance == 0:
+                    break
+        if best is None:
+            self.references.append((image_hash, size, element))
+            return None
+        self.duplicates += 1
+        return best
+
+    def report(self):
+        """Prints how many inferences were saved."""
+        if self.frames:
+            print(
+                f"Near-duplicate frames: {self.duplicates} of {self.frames} images reused "
+                f"the detections of a previous frame, "
+                f"{self.frames - self.duplicates} inferences were run"
+            )
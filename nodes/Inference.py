@@ -1,6 +1,15 @@
+import os
 import numpy as np
-from ultralytics import YOLO
+import torch
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+from nodes.Prefetcher import Prefetcher
+from nodes.Cache import FrameCache, PredictionCache, file_hash
+from nodes.Profiler import NullProfiler
+from nodes.Backend import load_model
+from nodes.Datagen import image_size
+from nodes.Dedup import FrameDeduplicator, dhash
+from nodes.Scheduler import MemoryScheduler
 
 
 class Inferencer:
@@ -8,13 +17,53 @@ class Inferencer:
     Class for performing inference using a YOLO model and processing the results.
 
     Args:
-        elements (DataGen): Dataset for inference.
+        elements (iterable): Elements for inference, either a list or a lazy DataGen stream.
         model_path (str, optional): Path to the YOLO model file. Defaults to "yolov8m.pt".
         imgsz (int, optional): Input image size. Defaults to 640.
         conf (float, optional): Confidence threshold. Defaults to 0.7.
         iou (float, optional): Intersection over Union (IoU) threshold. Defaults to 0.8.
         model (YOLO, optional): Pre-initialized YOLO model. Defaults to None.
+        backend (str, optional): Runtime of the model loaded from model_path: "torch", or "onnx" and
+            "openvino" with the weights exported once and cached. Defaults to "torch".
+        sam_predictor (FastSAMPredictor, optional): Pre-initialized FastSAM predictor for zero-shot
+            segmentation. Defaults to None.
         classes_list (list, optional): List of class labels. Defaults to None.
+        batch_size (int, optional): Number of images passed to the model in one call. Defaults to 1.
+        decode_workers (int, optional): Number of threads decoding upcoming images while the model
+            runs, 0 decodes them sequentially. Defaults to 4.
+        prefetch_depth (int, optional): Maximum number of images decoded ahead of the model. Defaults to 16.
+        contour_workers (int, optional): Number of threads converting masks to polygons for images
+            with many instances. Defaults to 4.
+        sam_imgsz (int, optional): Input image size of FastSAM in zero-shot segmentation. Defaults to 1024.
+        cache_dir (str, optional): Folder of the on-disk prediction cache, None disables it. Defaults to None.
+        cache_max_mb (float, optional): Size limit of the prediction cache in megabytes. Defaults to 2048.
+        cache_conf (float, optional): Confidence floor the cached predictions are stored at. Defaults to 0.05.
+        mask_format (str, optional): Format of the instance masks, "polygon" or "rle" for COCO
+            run-length encoding. Defaults to "polygon".
+        tile_size (int, optional): Side of the square tiles large images are cut into for sliced
+            inference, None runs the model on the whole image. Defaults to None.
+        tile_overlap (float, optional): Overlap of neighbouring tiles as a fraction of tile_size.
+            Defaults to 0.2.
+        tile_merge_threshold (float, optional): Intersection over the smaller box above which
+            detections of the same class from different tiles are merged. Defaults to 0.5.
+        reduced_decode (bool, optional): Whether JPEG images much larger than imgsz are decoded at
+            1/2, 1/4 or 1/8 scale, the detections are scaled back to the full resolution. Not used
+            in sliced inference. Defaults to True.
+        dedup_distance (int, optional): Maximum Hamming distance between the perceptual hashes of
+            near-duplicate frames, which reuse the detections of the earlier frame instead of
+            going through the model. None disables deduplication. Defaults to None.
+        frame_cache_dir (str, optional): Folder of the on-disk cache of decoded images, shared by
+            runs and processes through mmap, None disables it. Defaults to None.
+        frame_cache_max_mb (float, optional): Size limit of the decoded image cache in megabytes.
+            Defaults to 8192.
+        max_memory_mb (float, optional): Memory budget of the process in megabytes, the batch size
+            and the prefetch depth are then adapted to it, up to batch_size and batch_size +
+            prefetch_depth images in flight. None keeps them fixed. Defaults to None.
+        routes (list, optional): Inferencers of other models run over the same decoded images,
+            each with the offset added to its class IDs, their detections are merged with the
+            detections of this model. Defaults to None.
+        profiler (Profiler, optional): Collects stage timings and per-image latencies, None disables
+            profiling. Defaults to None.
     """
 
     def __init__(
@@ -26,10 +75,31 @@ class Inferencer:
         conf=0.4,
         iou=0.8,
         model=None,
+        backend="torch",
+        sam_predictor=None,
         classes_list=None,
         minimize_points=True,
         use_box_propt_sam=False,
         conf_dict={},
+        batch_size=1,
+        decode_workers=4,
+        prefetch_depth=16,
+        contour_workers=4,
+        sam_imgsz=1024,
+        cache_dir=None,
+        cache_max_mb=2048,
+        cache_conf=0.05,
+        mask_format="polygon",
+        tile_size=None,
+        tile_overlap=0.2,
+        tile_merge_threshold=0.5,
+        reduced_decode=True,
+        dedup_distance=None,
+        frame_cache_dir=None,
+        frame_cache_max_mb=8192,
+        max_memory_mb=None,
+        routes=None,
+        profiler=None,
     ) -> None:
         self.segment = segment
         self.model_path = model_path
@@ -37,206 +107,1134 @@ class Inferencer:
         self.conf = conf
         self.iou = iou
         if model is None:
-            self.model = YOLO(model_path)  # Load the model from the specified path
+            # Load the model from the specified path, exported to the backend runtime if needed
+            self.model = load_model(model_path, backend, imgsz)
         else:
             self.model = model
         self.elements = elements
         self.classes = classes_list
         self.conf_dict = conf_dict
+        # Per-class threshold lookup array built once from conf_dict, indexed by class ID
+        self.conf_thresholds = None
+        if len(conf_dict) != 0:
+            self.conf_thresholds = np.full(int(max(conf_dict)) + 1, np.inf)
+            for class_id, class_conf in conf_dict.items():
+                self.conf_thresholds[int(class_id)] = float(class_conf)
         self.minimize_points = minimize_points
+        self.batch_size = max(1, int(batch_size))
+        self.decode_workers = decode_workers
+        self.prefetch_depth = prefetch_depth
+        self.contour_workers = contour_workers
+        self.parallel_contours_min = 8  # Minimum number of masks worth the worker pool
+        self._contour_pool = None
+        if mask_format not in ("polygon", "rle"):
+            raise ValueError(f"Mask format must be 'polygon' or 'rle', got '{mask_format}'")
+        self.mask_format = mask_format
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_merge_threshold = tile_merge_threshold
+        self.reduced_decode = reduced_decode
+        self.sam_imgsz = sam_imgsz
+        self.deduplicator = None
+        if dedup_distance is not None:
+            self.deduplicator = FrameDeduplicator(dedup_distance)
+        self.frame_cache = None
+        if frame_cache_dir is not None:
+            self.frame_cache = FrameCache(frame_cache_dir, frame_cache_max_mb)
+        self.scheduler = None
+        if max_memory_mb is not None:
+            self.scheduler = MemoryScheduler(
+                max_memory_mb,
+                self.batch_size,
+                self.batch_size + self.prefetch_depth,
+                segment=segment,
+                mask_pixels=int(tile_size) ** 2 if tile_size is not None else None,
+            )
+            # Start with a single image in flight and grow while the budget allows it
+            self.batch_size = self.scheduler.batch_size
+            self.prefetch_depth = self.scheduler.prefetch_depth
+        self._prefetcher = None
+        self.routes = list(routes) if routes is not None else []
+        # Whether the FastSAM results are kept in the elements for the other models of the routes
+        self._share_sam = False
+        self.profiler = profiler if profiler is not None else NullProfiler()
 
         self.use_box_propt_sam = use_box_propt_sam
         if self.use_box_propt_sam and self.segment:
-            from ultralytics.models.fastsam import FastSAMPredictor
-
-            # Create FastSAMPredictor
-            overrides = dict(
-                conf=0.15,
-                task="segment",
-                mode="predict",
-                model="FastSAM-x.pt",
-                save=False,
-                imgsz=1024,
-                verbose=False,
-                iou=0.85
-            )
-            self.FastSAMPredictor = FastSAMPredictor(overrides=overrides)
+            if sam_predictor is None:
+                sam_predictor = self.create_sam_predictor(sam_imgsz)
+            self.FastSAMPredictor = sam_predictor
 
             print(
                 "Instance segmentation will be performed using a zero-shot approach "
                 "thanks to feeding detected boxes through a pre-trained SAM network."
             )
 
+        # Confidence passed to the model, cached predictions are stored at a lower floor
+        self.predict_conf = self.conf
+        self.cache = None
+        if cache_dir is not None:
+            self.predict_conf = min(self.conf, cache_conf)
+            settings = {
+                "weights": file_hash(model_path) if os.path.isfile(model_path) else model_path,
+                "imgsz": imgsz,
+                "iou": iou,
+                "backend": backend,
+                "classes": classes_list,
+                "segment": segment,
+                "minimize_points": minimize_points,
+                "use_box_propt_sam": use_box_propt_sam,
+                "sam_imgsz": sam_imgsz,
+                "mask_format": mask_format,
+                "tile_size": tile_size,
+                "tile_overlap": tile_overlap,
+                "tile_merge_threshold": tile_merge_threshold,
+                "reduced_decode": reduced_decode,
+            }
+            if tile_size is not None:
+                # Tile predictions are stored before they are merged across tile borders
+                settings["tile_predictions"] = "unmerged"
+            self.cache = PredictionCache(cache_dir, settings, cache_max_mb)
+
+    @staticmethod
+    def create_sam_predictor(sam_imgsz=1024):
+        """
+        Creates the FastSAM predictor used for zero-shot segmentation.
+
+        Args:
+            sam_imgsz (int, optional): Input image size of FastSAM. Defaults to 1024.
+
+        Returns:
+            FastSAMPredictor: Predictor segmenting everything in an image.
+        """
+        from ultralytics.models.fastsam import FastSAMPredictor
+
+        # Create FastSAMPredictor
+        overrides = dict(
+            conf=0.15,
+            task="segment",
+            mode="predict",
+            model="FastSAM-x.pt",
+            save=False,
+            imgsz=sam_imgsz,
+            verbose=False,
+            iou=0.85,
+            retina_masks=True,
+        )
+        return FastSAMPredictor(overrides=overrides)
+
     def process(self):
         """
         Processes the dataset for inference.
 
         Returns:
-            DataGen: Processed dataset with inference results.
+            list: Processed elements with inference results.
+        """
+        return list(self.stream())
+
+    def stream(self):
+        """
+        Lazily runs inference over the elements, batch_size images per model call.
+
+        The image of each element is decoded right before inference and released as soon as
+        its results are computed, so only the metadata and detections are kept.
+
+        Yields:
+            Element: Element with inference results and without pixel data.
         """
         mask_id = 0
+        batches = self._batches()
 
-        for element in self.elements:
-            predictions = self.model.predict(
-                element.image,
-                imgsz=self.imgsz,
-                conf=self.conf,
-                iou=self.iou,
-                verbose=False,
-                classes=self.classes,
-                retina_masks=True,
-            )
+        while True:
+            # Time the model waits for decoded images
+            with self.profiler.stage("wait_for_images"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            duplicates = self._find_duplicates(batch)
+            to_infer = [element for element in batch if element not in duplicates]
+            if self.routes:
+                self._infer_routes(to_infer)
+            else:
+                self.infer_batch(to_infer)
+
+            for element in batch:
+                if element in duplicates:
+                    self._reuse(element, duplicates[element])
+                # Find annotation ID for each detection relative to the entire dataset
+                element.annotations_id = np.arange(mask_id, mask_id + len(element.category_id))
+                mask_id += len(element.annotations_id)
+                # Pixel data is no longer needed after inference
+                element.release_image()
+                self.profiler.finish_image(element.file_name, len(element.annotations_id))
+                yield element
+
+            if self.scheduler is not None:
+                self._schedule(batch)
+
+        if self.deduplicator is not None:
+            self.deduplicator.report()
+
+    def infer_batch(self, elements, shared=False):
+        """
+        Runs the model over a batch of elements and stores the detections in them.
+
+        Args:
+            elements (list): Elements with decoded images or cached predictions.
+            shared (bool, optional): Whether the images are decoded once for several models. The
+                predictions are then looked up in the cache of this model first, and the FastSAM
+                results of an image are kept in the element for the other models.
+                Defaults to False.
+        """
+        self._share_sam = shared
+        if shared:
+            for element in elements:
+                self._lookup(element)
+        # Images with cached predictions do not go through the model
+        to_predict = [element for element in elements if element.predictions is None]
+        batch_predictions = []
+        if to_predict and self.tile_size is not None:
+            # Each image is sliced into tiles, which go through the model in batches
+            batch_predictions = [self._predict_tiles(element) for element in to_predict]
+        elif to_predict:
+            # N images go through the model in a single call, results keep the input order
+            with self.profiler.stage("predict"):
+                batch_predictions = self.model.predict(
+                    [element.image for element in to_predict],
+                    imgsz=self.imgsz,
+                    conf=self.predict_conf,
+                    iou=self.iou,
+                    verbose=False,
+                    classes=self.classes,
+                    retina_masks=True,
+                )
+        if self.scheduler is not None:
+            # The masks of the whole batch are allocated at this point
+            self.scheduler.sample()
+        batch_predictions = iter(batch_predictions)
+
+        for element in elements:
+            with self.profiler.stage("postprocess"):
+                if element.predictions is None:
+                    self._postprocess(element, next(batch_predictions))
+                else:
+                    # Re-filter the cached predictions with the current confidence thresholds
+                    self._apply_predictions(element, element.predictions)
+                    element.predictions = None
+
+    def _find_duplicates(self, batch):
+        """
+        Finds the near-duplicates of earlier frames in a batch.
+
+        Args:
+            batch (list): Elements of the batch, in stream order.
+
+        Returns:
+            dict: Reference element of each duplicate element. The earlier frame comes first in
+                the stream, so its detections are ready when they are reused.
+        """
+        duplicates = {}
+        if self.deduplicator is None:
+            return duplicates
+        for element in batch:
+            # Images with cached predictions are not decoded and have no hash
+            if element.image_hash is not None and element.predictions is None:
+                reference = self.deduplicator.find(element, element.image_hash)
+                if reference is not None:
+                    duplicates[element] = reference
+        return duplicates
 
-            predictions = predictions[0]
-            # Filter by confidence
-            if len(self.conf_dict) != 0:
-                filtered_indices = [
-                    i
-                    for i, (conf, classs) in enumerate(
-                        zip(
-                            predictions.boxes.conf.cpu().float().tolist(),
-                            predictions.boxes.cls.cpu().int().tolist(),
-                        )
+    def _infer_routes(self, elements):
+        """
+        Runs this model and the models of the routes over the same decoded images.
+
+        Each model filters its detections with its own classes and thresholds, then the
+        detections of all models are merged in the elements with global class IDs. In zero-shot
+        segmentation the FastSAM "everything" pass runs once per image, on the first model with
+        boxes in it, and its masks are shared by the other models.
+
+        Args:
+            elements (list): Elements with decoded images.
+        """
+        parts = [[] for _ in elements]
+        for inferencer, class_offset in [(self, 0)] + self.routes:
+            inferencer.infer_batch(elements, shared=True)
+            for element_parts, element in zip(parts, elements):
+                element_parts.append(
+                    (
+                        element.bbox,
+                        element.category_id + class_offset,
+                        element.areas,
+                        element.mask_data,
+                        element.mask_offsets,
+                        element.mask_rle,
                     )
-                    if self.conf_dict[classs] <= conf
-                ]
-            else:
-                filtered_indices = [i for i in range(len(predictions))]
-            # Convert boxes to COCO format
-            element.bbox = [
-                [box[0], box[1], box[2] - box[0], box[3] - box[1]]
-                for i, box in enumerate(predictions.boxes.xyxy.cpu().float().tolist())
-                if i in filtered_indices
-            ]
-            # Calculate class IDs for each detected object in the image
-            element.category_id = [
-                cls + 1
-                for i, cls in enumerate(predictions.boxes.cls.cpu().int().tolist())
-                if i in filtered_indices
-            ]
-            # Find annotation ID for each detection relative to the entire dataset
-            element.annotations_id = [mask_id + i for i in range(len(filtered_indices))]
-            if self.segment:
-                if self.use_box_propt_sam:
-                    # process boxes as input pompt for sam
+                )
+        with self.profiler.stage("merge_models"):
+            for element_parts, element in zip(parts, elements):
+                self._merge_detections(element, element_parts)
+                element.sam_results = None
+
+    @staticmethod
+    def _merge_detections(element, parts):
+        """
+        Stores the concatenated detections of several models in the element.
+
+        In segmentation mode the detections of a model without masks get an empty mask, they are
+        exported as plain boxes. The crowd flag is kept per detection, as only RLE masks are
+        imported as crowd annotations.
+
+        Args:
+            element (Element): Element the detections belong to.
+            parts (list): Boxes, class IDs, areas and packed masks found by each model.
+        """
+        element.bbox = np.concatenate([part[0] for part in parts]).reshape(-1, 4)
+        element.category_id = np.concatenate([part[1] for part in parts])
+        element.areas = np.concatenate([part[2] for part in parts])
+        element.iscrowd = np.concatenate(
+            [np.full(len(part[0]), int(part[5]), dtype=np.int64) for part in parts]
+        )
+        element.mask_data = None
+        element.mask_offsets = None
+        element.mask_rle = False
+        if all(part[4] is None for part in parts):
+            return
+
+        data, offsets, start = [], [np.zeros(1, dtype=np.int64)], 0
+        for bbox, _, _, mask_data, mask_offsets, _ in parts:
+            if mask_offsets is None:
+                mask_data = np.zeros(0, dtype=np.int64)
+                mask_offsets = np.zeros(len(bbox) + 1, dtype=np.int64)
+            data.append(mask_data)
+            offsets.append(mask_offsets[1:] + start)
+            start += len(mask_data)
+        element.mask_data = np.concatenate(data)
+        element.mask_offsets = np.concatenate(offsets)
+        element.mask_rle = any(part[5] for part in parts)
+
+    def _batches(self):
+        """
+        Groups the elements into batches of decoded images.
+
+        Yields:
+            list: Up to batch_size elements with loaded images or cached predictions.
+        """
+        if self.decode_workers > 0:
+            # Decode upcoming images in worker threads while the model runs
+            elements = self._prefetcher = Prefetcher(
+                self.elements, self._prepare, self.decode_workers, self.prefetch_depth
+            )
+        else:
+            elements = map(self._prepare, self.elements)
+
+        batch = []
+        for element in elements:
+            if element.image is None and element.predictions is None:
+                print(f"Error processing file '{element.file_name}': image can not be read")
+                continue
+            if batch and self.scheduler is not None and not self.scheduler.fits(batch + [element]):
+                # The next image does not fit the memory budget together with the batch
+                yield batch
+                batch = []
+            batch.append(element)
+            # The batch size can change between batches with a memory budget
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _schedule(self, batch):
+        """
+        Adapts the batch size and the prefetch depth to the memory budget after a batch.
+
+        Args:
+            batch (list): Processed elements of the batch.
+        """
+        self.scheduler.update(batch)
+        self.batch_size = self.scheduler.batch_size
+        self.prefetch_depth = self.scheduler.prefetch_depth
+        if self._prefetcher is not None:
+            self._prefetcher.depth = self.prefetch_depth
+
+    def _prepare(self, element):
+        """
+        Prepares an element for inference, runs in the prefetch worker threads.
+
+        The raw predictions are looked up in the cache first, the image is decoded only on a miss,
+        or mapped from the decoded image cache.
+
+        Args:
+            element (Element): Element to prepare.
+
+        Returns:
+            Element: The same element with the decoded image or the cached predictions.
+        """
+        self.profiler.start_image(element.file_name)
+        if not self.routes:
+            # With several models the image is decoded for all of them, each one looks up
+            # its own predictions in infer_batch
+            self._lookup(element)
+            # FastSAM segments the merged tile boxes, it needs the image also on a cache hit
+            if element.predictions is not None and not (
+                self.tile_size is not None and self.use_box_propt_sam
+            ):
+                element.width = element.predictions["width"]
+                element.height = element.predictions["height"]
+                return element
+        with self.profiler.stage("decode"):
+            element.load_image(self._decode_factor(element), self.frame_cache)
+        if self.deduplicator is not None and element.image is not None:
+            with self.profiler.stage("dedup_hash"):
+                element.image_hash = dhash(element.image)
+        return element
+
+    def _lookup(self, element):
+        """
+        Looks up the raw predictions of an element in the prediction cache of this model.
+
+        Args:
+            element (Element): Element with the image path, its cache_key and predictions are set,
+                to None without a cache or on a miss.
+        """
+        element.cache_key = None
+        element.predictions = None
+        if self.cache is not None and element.file_path is not None:
+            with self.profiler.stage("cache_lookup"):
+                try:
+                    element.cache_key = self.cache.key(element.file_path)
+                except OSError as e:
+                    # An unreadable file is a cache miss, decoding reports it and skips it
+                    print(f"Error processing file '{element.file_name}': {e}")
+                    return
+                element.predictions = self.cache.get(element.cache_key, self.predict_conf)
+
+    def _decode_factor(self, element):
+        """
+        Chooses how much an image is downscaled while it is decoded, from the size in its header.
+
+        The model letterboxes the longest side of the image to imgsz (FastSAM to sam_imgsz), so
+        the image is decoded at the smallest scale that is still at least that large. Only JPEG
+        is scaled by the decoder itself, other formats are decoded at full resolution.
+
+        Args:
+            element (Element): Element to decode, its width and height are set to the full
+                resolution size when the image is downscaled.
+
+        Returns:
+            int: Downscale factor, 1, 2, 4 or 8.
+        """
+        if (
+            not self.reduced_decode
+            or self.tile_size is not None
+            or element.file_path is None
+            or not element.file_path.lower().endswith((".jpg", ".jpeg"))
+        ):
+            return 1
+        size = image_size(element.file_path)
+        if size is None:
+            return 1
+        # The image is decoded once for all models
+        target = max(
+            int(np.max(inferencer.imgsz)) for inferencer in [self] + [r for r, _ in self.routes]
+        )
+        if self.segment and self.use_box_propt_sam:
+            target = max(target, int(np.max(self.sam_imgsz)))
+        for factor in (8, 4, 2):
+            if max(size) >= factor * target:
+                element.width, element.height = size
+                return factor
+        return 1
+
+    def _postprocess(self, element, predictions):
+        """
+        Filters the predictions of a single image and stores them in the element in COCO format.
+
+        All filtering and box conversions are done on numpy arrays, only the final values are
+        turned into Python lists. With the cache enabled every prediction is segmented and stored
+        before filtering, so that later runs can re-filter them with other thresholds.
+
+        Args:
+            element (Element): Element the predictions belong to.
+            predictions (Results | dict): Model predictions for the element image, or the unmerged
+                tile predictions in sliced inference.
+        """
+        if self.tile_size is not None:
+            self._postprocess_tiles(element, predictions)
+            return
+
+        boxes = predictions.boxes
+        xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
+        classes = boxes.cls.cpu().numpy().astype(np.int64)
+        confs = boxes.conf.cpu().numpy().astype(np.float64)
+        # Boxes in full resolution coordinates when the image was decoded downscaled
+        scale_x, scale_y = element.decode_scale()
+        full_xyxy = xyxy * [scale_x, scale_y, scale_x, scale_y]
+
+        if self.cache is not None and element.cache_key is not None:
+            record = {
+                "xyxy": full_xyxy.astype(np.float32),
+                "confs": boxes.conf.cpu().numpy(),
+                "classes": classes,
+                "segments": self._segment(element, predictions, np.arange(len(confs)), xyxy),
+                "width": element.width,
+                "height": element.height,
+                "conf_floor": self.predict_conf,
+            }
+            with self.profiler.stage("cache_store"):
+                self.cache.put(element.cache_key, record)
+            self._apply_predictions(element, record)
+            return
+
+        # Filter by confidence with a single boolean mask
+        indices = np.flatnonzero(self._confidence_mask(confs, classes))
+        segments = self._segment(element, predictions, indices, xyxy[indices])
+        self._store(element, full_xyxy[indices], classes[indices], segments)
+
+    def _postprocess_tiles(self, element, predictions):
+        """
+        Filters the tile predictions of a single image, merges them and stores them in the element.
+
+        With the cache enabled the unmerged predictions are stored, so that later runs filter
+        them with their own thresholds before merging, like the predictions of whole images.
+
+        Args:
+            element (Element): Element the predictions belong to.
+            predictions (dict): Unmerged tile predictions with xyxy, confs, classes, tile_ids and
+                mask ROIs.
+        """
+        record = dict(
+            predictions,
+            segments=None,
+            width=element.width,
+            height=element.height,
+            conf_floor=self.predict_conf,
+        )
+        if self.cache is not None and element.cache_key is not None:
+            with self.profiler.stage("cache_store"):
+                self.cache.put(element.cache_key, record)
+        self._apply_predictions(element, record)
+
+    def _store_tiles(self, element, record, indices):
+        """
+        Merges the filtered tile detections of an image and stores them in the element.
+
+        The detections are merged after filtering, so detections under their threshold do not
+        grow the boxes and masks of the detections they overlap.
+
+        Args:
+            element (Element): Element the predictions belong to.
+            record (dict): Unmerged tile predictions with xyxy, confs, classes, tile_ids and
+                mask ROIs.
+            indices (np.ndarray): Indices of the detections above their confidence threshold.
+        """
+        rois = record["rois"]
+        with self.profiler.stage("tile_merge"):
+            merged = self._merge_tiles(
+                record["xyxy"].astype(np.float64)[indices],
+                record["confs"].astype(np.float64)[indices],
+                record["classes"].astype(np.int64)[indices],
+                record["tile_ids"][indices],
+                [rois[i] for i in indices] if rois is not None else None,
+            )
+        xyxy, rois = merged["xyxy"], merged["rois"]
+
+        segments = None
+        if self.segment and self.use_box_propt_sam:
+            segments = self._segment(element, None, np.arange(len(xyxy)), xyxy)
+        elif self.segment and rois is not None and self.mask_format == "rle":
+            with self.profiler.stage("encode_rle"):
+                segments = [self._roi_rle(*roi, element.height, element.width) for roi in rois]
+        elif self.segment and rois is not None:
+            with self.profiler.stage("minimize_contours"):
+                segments = self._map_contours(
+                    lambda roi: self._roi_contour(*roi, self.minimize_points), rois
+                )
+        self._store(element, xyxy, merged["classes"], segments)
+
+    def _tile_windows(self, width, height):
+        """
+        Computes the overlapping tiles covering an image.
+
+        Args:
+            width (int): Width of the image.
+            height (int): Height of the image.
+
+        Returns:
+            list: Tiles as (x0, y0, x1, y1) pixel windows, the last row and column are aligned
+                with the image border.
+        """
+        tile = int(self.tile_size)
+        step = max(1, int(tile * (1 - self.tile_overlap)))
+
+        def starts(size):
+            if size <= tile:
+                return [0]
+            return list(range(0, size - tile, step)) + [size - tile]
+
+        return [
+            (x0, y0, min(x0 + tile, width), min(y0 + tile, height))
+            for y0 in starts(height)
+            for x0 in starts(width)
+        ]
+
+    def _predict_tiles(self, element):
+        """
+        Runs the model over the tiles of an image.
+
+        Only the tiles go through the model and the masks are kept at tile resolution, cropped
+        to the box of each detection, so the memory used does not grow with the image size.
+
+        Args:
+            element (Element): Element with the decoded image.
+
+        Returns:
+            dict: Unmerged predictions in image coordinates with xyxy, confs, classes, tile_ids
+                and rois, the mask of each detection with its offset, or None without masks.
+        """
+        image = element.image
+        windows = self._tile_windows(image.shape[1], image.shape[0])
+        keep_masks = self.segment and not self.use_box_propt_sam
+        xyxy, confs, classes, tile_ids, rois = [], [], [], [], []
+
+        for start in range(0, len(windows), self.batch_size):
+            chunk = windows[start : start + self.batch_size]
+            with self.profiler.stage("predict"):
+                results = self.model.predict(
+                    [np.ascontiguousarray(image[y0:y1, x0:x1]) for x0, y0, x1, y1 in chunk],
+                    imgsz=self.imgsz,
+                    conf=self.predict_conf,
+                    iou=self.iou,
+                    verbose=False,
+                    classes=self.classes,
+                    retina_masks=True,
+                )
+            for tile_id, ((x0, y0, _, _), result) in enumerate(zip(chunk, results), start=start):
+                boxes = result.boxes
+                tile_xyxy = boxes.xyxy.cpu().numpy().astype(np.float64)
+                xyxy.append(tile_xyxy + [x0, y0, x0, y0])
+                confs.append(boxes.conf.cpu().numpy().astype(np.float64))
+                classes.append(boxes.cls.cpu().numpy().astype(np.int64))
+                tile_ids.append(np.full(len(tile_xyxy), tile_id))
+                if keep_masks and result.masks is not None:
+                    # Masks are at tile resolution, only the box region of each one is kept
+                    masks = result.masks.data
+                    height, width = masks.shape[1:]
+                    for mask, (bx0, by0, bx1, by1) in zip(masks, tile_xyxy):
+                        bx0, by0 = max(int(bx0), 0), max(int(by0), 0)
+                        bx1, by1 = min(int(np.ceil(bx1)), width), min(int(np.ceil(by1)), height)
+                        roi = mask[by0:by1, bx0:bx1].cpu().numpy() > 0.5
+                        rois.append((roi, x0 + bx0, y0 + by0))
+
+        xyxy = np.concatenate(xyxy).reshape(-1, 4)
+        if len(rois) != len(xyxy):
+            # Detection model, or masks are not needed
+            rois = None
+        return {
+            "xyxy": xyxy,
+            "confs": np.concatenate(confs),
+            "classes": np.concatenate(classes),
+            "tile_ids": np.concatenate(tile_ids),
+            "rois": rois,
+        }
 
+    def _merge_tiles(self, xyxy, confs, classes, tile_ids, rois):
+        """
+        Greedily merges detections of the same object found in overlapping tiles.
+
+        An object cut by a tile border is detected partially in each tile, so the overlap is
+        measured relative to the smaller box. Detections are visited by decreasing confidence,
+        each one absorbs the same class detections of other tiles overlapping it, its box and
+        mask become the union of the absorbed ones.
+
+        Args:
+            xyxy (np.ndarray): Boxes in image coordinates with shape (N, 4).
+            confs (np.ndarray): Confidence of each detection.
+            classes (np.ndarray): Class ID of each detection.
+            tile_ids (np.ndarray): Tile of each detection.
+            rois (list | None): Mask of each detection with its offset, None without masks.
+
+        Returns:
+            dict: Merged predictions with xyxy, confs, classes and rois.
+        """
+        order = np.argsort(-confs, kind="stable")
+        areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+        merged = np.zeros(len(confs), dtype=bool)
+        keep, boxes, merged_rois = [], [], []
+
+        for i in order:
+            if merged[i]:
+                continue
+            width = np.minimum(xyxy[i, 2], xyxy[:, 2]) - np.maximum(xyxy[i, 0], xyxy[:, 0])
+            height = np.minimum(xyxy[i, 3], xyxy[:, 3]) - np.maximum(xyxy[i, 1], xyxy[:, 1])
+            intersection = width.clip(0) * height.clip(0)
+            overlap = intersection / np.maximum(np.minimum(areas[i], areas), 1e-9)
+            group = np.flatnonzero(
+                ~merged
+                & (classes == classes[i])
+                & (tile_ids != tile_ids[i])
+                & (overlap > self.tile_merge_threshold)
+            )
+            group = np.concatenate([[i], group])
+            merged[group] = True
+
+            keep.append(i)
+            boxes.append(np.concatenate([xyxy[group, :2].min(axis=0), xyxy[group, 2:].max(axis=0)]))
+            if rois is not None:
+                merged_rois.append(self._union_rois([rois[j] for j in group]))
+
+        return {
+            "xyxy": np.array(boxes, dtype=np.float64).reshape(-1, 4),
+            "confs": confs[keep],
+            "classes": classes[keep],
+            "rois": merged_rois if rois is not None else None,
+        }
+
+    @staticmethod
+    def _union_rois(rois):
+        """
+        Stitches the masks of merged detections within the region they cover.
+
+        Args:
+            rois (list): Masks with their x, y offsets in the image.
+
+        Returns:
+            tuple: Union mask with its x, y offsets.
+        """
+        if len(rois) == 1:
+            return rois[0]
+        x0 = min(x for _, x, _ in rois)
+        y0 = min(y for _, _, y in rois)
+        x1 = max(x + mask.shape[1] for mask, x, _ in rois)
+        y1 = max(y + mask.shape[0] for mask, _, y in rois)
+        union = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for mask, x, y in rois:
+            union[y - y0 : y - y0 + mask.shape[0], x - x0 : x - x0 + mask.shape[1]] |= mask
+        return union, x0, y0
+
+    @staticmethod
+    def _reuse(element, reference):
+        """
+        Stores the detections of a near-duplicate frame in the element.
+
+        The detection arrays are shared with the reference element, the annotation IDs are
+        assigned to the element afterwards.
+
+        Args:
+            element (Element): Element the detections are reused for.
+            reference (Element): Earlier element with the same content and size.
+        """
+        element.bbox = reference.bbox
+        element.category_id = reference.category_id
+        element.areas = reference.areas
+        element.mask_data = reference.mask_data
+        element.mask_offsets = reference.mask_offsets
+        element.mask_rle = reference.mask_rle
+        element.iscrowd = reference.iscrowd
+
+    def _apply_predictions(self, element, record):
+        """
+        Filters raw (e.g. cached) predictions and stores them in the element in COCO format.
+
+        Args:
+            element (Element): Element the predictions belong to.
+            record (dict): Raw predictions with xyxy, confs, classes and segments, or the
+                unmerged tile predictions in sliced inference.
+        """
+        classes = record["classes"].astype(np.int64)
+        confs = record["confs"].astype(np.float64)
+        indices = np.flatnonzero(self._confidence_mask(confs, classes))
+        if self.tile_size is not None:
+            self._store_tiles(element, record, indices)
+            return
+        segments = record["segments"]
+        if segments is not None:
+            segments = [segments[i] for i in indices]
+        xyxy = record["xyxy"].astype(np.float64)
+        self._store(element, xyxy[indices], classes[indices], segments)
+
+    def _segment(self, element, predictions, indices, xyxy):
+        """
+        Builds the polygons or RLE masks of the selected detections.
+
+        The masks are at the resolution of the decoded image, they are scaled to the full
+        resolution of the element.
+
+        Args:
+            element (Element): Element the predictions belong to, with the decoded image.
+            predictions (Results): Model predictions for the element image.
+            indices (np.ndarray): Indices of the detections to segment.
+            xyxy (np.ndarray): Boxes of the selected detections in xyxy format, in decoded image
+                coordinates.
+
+        Returns:
+            list | None: One polygon or RLE mask in COCO format per detection, or None without
+                masks.
+        """
+        if not self.segment:
+            return None
+        if self.use_box_propt_sam:
+            # process boxes as input pompt for sam, the SAM pass is skipped without boxes
+            if len(indices) == 0:
+                return []
+            xywh = xyxy.copy()
+            xywh[:, 2:] -= xywh[:, :2]
+            with self.profiler.stage("sam"):
+                everything_results = element.sam_results
+                if everything_results is None:
                     # Segment everything
-                    everything_results = self.FastSAMPredictor(element.image)
-
-                    detected_masks = []
-
-                    for box in element.bbox:
-
-                        # Bounding box prompt
-                        ann = self.FastSAMPredictor.prompt(everything_results,
-                            bboxes=[[
-                                int(box[0]),
-                                int(box[1]),
-                                int(box[2] + box[0]),
-                                int(box[3] + box[1]),
-                            ]]
-                        )[0]
-
-                        # List of masks in COCO format
-                        if self.minimize_points:
-                            detected_mask = self.minimize_contours(
-                                ann.masks.data.cpu().numpy(), [0], element.image
-                            )[0]
-                        else:
-                            detected_mask = ann.masks.xy[0].flatten()
-
-                        detected_masks.append(detected_mask)
-
-                    element.detected_masks = [
-                        [
-                            (
-                                float(detected_masks[i][j])
-                                if j % 2 == 1
-                                else float(detected_masks[i][j])
-                            )
-                            for j in range(len(detected_masks[i]))
-                        ]
-                        for i in range(len(detected_masks))
-                    ]
-
-                    element.areas = [0 for i, _ in enumerate(element.detected_masks)]
-                    # Set flag for group object
-                    element.isscrowd = 0
-                else:
-                    try:
-                        # List of masks in COCO format
-                        if self.minimize_points:
-                            element.detected_masks = self.minimize_contours(
-                                predictions.masks.data.cpu().numpy(),
-                                filtered_indices,
-                                element.image,
-                            )
-                        else:
-                            detected_masks = [
-                                mask.flatten()
-                                for i, mask in enumerate(predictions.masks.xy)
-                                if i in filtered_indices
-                            ]
-                            element.detected_masks = [
-                                [
-                                    (
-                                        float(detected_masks[i][j])
-                                        if j % 2 == 1
-                                        else float(detected_masks[i][j])
-                                    )
-                                    for j in range(len(detected_masks[i]))
-                                ]
-                                for i in range(len(detected_masks))
-                            ]
-
-                        element.areas = [
-                            0 for i, mask in enumerate(predictions.masks.xy)
-                            if i in filtered_indices
-                        ]
-                        # Set flag for group object
-                        element.isscrowd = 0
-                    except AttributeError:
-                        # If the model is not a segmentation model, the list of masks is empty and we calculate areas by bbox
-                        element.detected_masks = []
-                        element.areas = [box[2] * box[3] for box in element.bbox]
+                    everything_results = self.FastSAMPredictor(element.image)[0]
+                    if self._share_sam:
+                        element.sam_results = everything_results
+                return self._prompt_sam(
+                    everything_results, element.image, xywh, (element.height, element.width)
+                )
+        if predictions.masks is None:
+            # If the model is not a segmentation model, there are no masks
+            return None
+        size = (element.height, element.width)
+        # List of masks in COCO format
+        if self.mask_format == "rle":
+            with self.profiler.stage("encode_rle"):
+                return self.encode_masks(
+                    predictions.masks.data[indices].cpu().numpy(), element.image, size
+                )
+        if self.minimize_points:
+            with self.profiler.stage("minimize_contours"):
+                return self.minimize_contours(
+                    predictions.masks.data[indices].cpu().numpy(),
+                    range(len(indices)),
+                    element.image,
+                    size,
+                )
+        masks_xy = predictions.masks.xy
+        scale = element.decode_scale()
+        return [(masks_xy[i] * scale).flatten().astype(np.float64).tolist() for i in indices]
+
+    def _store(self, element, xyxy, classes, segments):
+        """
+        Stores the filtered detections in the element as numpy arrays.
+
+        Args:
+            element (Element): Element the detections belong to.
+            xyxy (np.ndarray): Boxes in xyxy format with shape (N, 4).
+            classes (np.ndarray): Class ID of each detection.
+            segments (list | None): Polygon or RLE mask of each detection, None for bbox annotations.
+        """
+        # Convert boxes to COCO format
+        xywh = xyxy.copy()
+        xywh[:, 2:] -= xywh[:, :2]
+        element.bbox = xywh
+        # Calculate class IDs for each detected object in the image
+        element.category_id = classes + 1
+
+        if segments is not None:
+            # Masks in COCO format, packed into flat arrays
+            element.detected_masks = segments
+            if self.mask_format == "rle":
+                # The mask area is the total length of the runs of ones
+                element.areas = np.array(
+                    [sum(segment["counts"][1::2]) for segment in segments], dtype=np.int64
+                )
+                # COCO RLE masks are imported as crowd annotations
+                element.iscrowd = 1
             else:
-                element.detected_masks = []
-                element.areas = [box[2] * box[3] for box in element.bbox]
-            mask_id += len(element.annotations_id)
-        return self.elements
+                element.areas = np.zeros(len(segments), dtype=np.int64)
+                # Set flag for group object
+                element.iscrowd = 0
+        else:
+            # Without masks we calculate areas by bbox
+            element.detected_masks = []
+            element.areas = xywh[:, 2] * xywh[:, 3]
+
+    def _prompt_sam(self, everything_results, image, xywh, size=None):
+        """
+        Segments the detected boxes with the masks of a single FastSAM pass over the image.
+
+        The "everything" masks are computed once and the IoU between every box and every mask
+        is evaluated at once, each box gets the mask with the highest IoU.
+
+        Args:
+            everything_results (Results): FastSAM results segmenting everything in the image.
+            image (np.ndarray): Image the boxes belong to.
+            xywh (np.ndarray): Detected boxes in COCO format with shape (N, 4).
+            size (tuple, optional): Height and width of the full resolution image the polygons
+                are scaled to, None keeps the image size. Defaults to None.
+
+        Returns:
+            list: One polygon in COCO format per box.
+        """
+        if size is None:
+            size = image.shape[:2]
+        if everything_results.masks is None:
+            if self.mask_format == "rle":
+                return [self._roi_rle(None, 0, 0, *size) for _ in range(len(xywh))]
+            return [[] for _ in range(len(xywh))]
+        masks = everything_results.masks.data
+
+        # Bounding box prompts in integer xyxy format clipped to the image
+        height, width = masks.shape[1:]
+        boxes = np.concatenate([xywh[:, :2], xywh[:, :2] + xywh[:, 2:]], axis=1).astype(np.int64)
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+
+        # Box vs mask IoU matrix with shape (N boxes, M masks)
+        bbox_areas = torch.as_tensor(
+            (boxes[:, 3] - boxes[:, 1]) * (boxes[:, 2] - boxes[:, 0]), device=masks.device
+        )
+        mask_areas = torch.stack(
+            [masks[:, y1:y2, x1:x2].sum(dim=(1, 2)) for x1, y1, x2, y2 in boxes.tolist()]
+        )
+        full_mask_areas = masks.sum(dim=(1, 2))
+        union = bbox_areas[:, None] + full_mask_areas[None] - mask_areas
+        best_masks = torch.argmax(mask_areas / union, dim=1)
+
+        # List of masks in COCO format
+        if self.mask_format == "rle":
+            with self.profiler.stage("encode_rle"):
+                return self.encode_masks(masks[best_masks].cpu().numpy(), image, size)
+        if self.minimize_points:
+            with self.profiler.stage("minimize_contours"):
+                detected_masks = self.minimize_contours(
+                    masks[best_masks].cpu().numpy(), range(len(best_masks)), image, size
+                )
+        else:
+            masks_xy = everything_results.masks.xy
+            scale = (size[1] / image.shape[1], size[0] / image.shape[0])
+            detected_masks = [(masks_xy[i] * scale).flatten() for i in best_masks.tolist()]
+
+        return [np.asarray(mask, dtype=np.float64).tolist() for mask in detected_masks]
 
-    def minimize_contours(self, predictions_masks_xy, filtered_indices, image):
+    def _confidence_mask(self, confs, classes):
+        """
+        Builds the boolean mask of detections passing their per-class confidence threshold.
+
+        Args:
+            confs (np.ndarray): Confidence of each detection.
+            classes (np.ndarray): Class ID of each detection.
+
+        Returns:
+            np.ndarray: Boolean mask of the detections to keep.
+        """
+        # The model keeps only detections strictly above its conf, the same is applied to cached ones
+        keep = confs > self.conf
+        if self.conf_thresholds is None:
+            return keep
+        # Classes without a threshold in conf_dict are dropped
+        thresholds = np.full(len(classes), np.inf)
+        known = classes < len(self.conf_thresholds)
+        thresholds[known] = self.conf_thresholds[classes[known]]
+        return keep & (thresholds <= confs)
+
+    def minimize_contours(self, predictions_masks_xy, filtered_indices, image, size=None):
         """
         Converts masks into minimized contours and saves points in the required format.
 
+        Only the bbox region of each instance is upscaled to the image resolution, and images
+        with many instances are processed across the contour worker pool.
+
         Args:
-            predictions_masks_xy (list): List of segments in pixel coordinates represented as tensors.
+            predictions_masks_xy (np.ndarray): Stack of binary masks at the model mask resolution.
             filtered_indices (list): Indices of masks to process.
+            image (np.ndarray): Image the masks belong to, the contours are in its pixel coordinates.
+            size (tuple, optional): Height and width the masks are upscaled to instead of the image
+                size, for an image decoded downscaled. Defaults to None.
         Returns:
             list: List of minimized contours in the form of a list of points.
         """
-        minimized_contours = []
-        predictions_masks_xy = np.array(predictions_masks_xy)
+        masks = [predictions_masks_xy[i] for i in filtered_indices]
+        if len(masks) == 0:
+            return []
+        mask_height, mask_width = masks[0].shape[:2]
+        height, width = image.shape[:2] if size is None else size
+        # Source row/column of every image pixel, the same mapping as cv2.resize with INTER_NEAREST
+        index_maps = (
+            self._nearest_indices(mask_height, height),
+            self._nearest_indices(mask_width, width),
+        )
 
-        for i, mask in enumerate(predictions_masks_xy):
-            if i in filtered_indices:
-                mask_resized = cv2.resize(
-                    np.array(mask),
-                    (image.shape[1], image.shape[0]),
-                    interpolation=cv2.INTER_NEAREST,
-                )
-                # Find all contours without hierarchy
-                mask_contours, _ = cv2.findContours(
-                    mask_resized.astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE
-                )
-                # Select the contour with the largest area
-                max_contour = max(mask_contours, key=cv2.contourArea)
-                # Simplify the contour
-                epsilon = 0.002 * cv2.arcLength(max_contour, True)  # Set the approximation accuracy
-                approx = cv2.approxPolyDP(
-                    max_contour, epsilon, True
-                )  # Get the approximated contour
-                # Convert all coordinate values to integers
-                mask_contour_int = list(map(int, approx.reshape(-1)))
-                minimized_contours.append(mask_contour_int)
-        return minimized_contours
+        return self._map_contours(lambda mask: self._minimize_contour(mask, index_maps), masks)
+
+    def _map_contours(self, function, masks):
+        """
+        Applies a contour function to the masks, across the contour worker pool if there are many.
+
+        Args:
+            function (callable): Function converting a single mask into a polygon.
+            masks (list): Masks to convert.
+
+        Returns:
+            list: Polygon of each mask.
+        """
+        if self.contour_workers > 1 and len(masks) >= self.parallel_contours_min:
+            if self._contour_pool is None:
+                self._contour_pool = ThreadPoolExecutor(max_workers=self.contour_workers)
+            return list(self._contour_pool.map(function, masks))
+        return [function(mask) for mask in masks]
+
+    @staticmethod
+    def _nearest_indices(src_size, dst_size):
+        """
+        Computes the source index of each destination pixel for nearest neighbour resizing.
+
+        Args:
+            src_size (int): Size of the source axis.
+            dst_size (int): Size of the destination axis.
+
+        Returns:
+            np.ndarray: Non-decreasing array of source indices with dst_size values.
+        """
+        scale = 1.0 / (dst_size / src_size)
+        indices = np.floor(np.arange(dst_size) * scale).astype(np.int64)
+        return np.minimum(indices, src_size - 1)
+
+    def encode_masks(self, masks, image, size=None):
+        """
+        Encodes masks in COCO uncompressed RLE at the image resolution.
+
+        Like minimize_contours, only the bbox region of each instance is upscaled.
+
+        Args:
+            masks (np.ndarray): Stack of binary masks at the model mask resolution.
+            image (np.ndarray): Image the masks belong to.
+            size (tuple, optional): Height and width the masks are upscaled to instead of the image
+                size, for an image decoded downscaled. Defaults to None.
+
+        Returns:
+            list: RLE mask of each instance as a dict with size and counts.
+        """
+        if len(masks) == 0:
+            return []
+        height, width = image.shape[:2] if size is None else size
+        index_maps = (
+            self._nearest_indices(masks.shape[1], height),
+            self._nearest_indices(masks.shape[2], width),
+        )
+
+        def encode(mask):
+            roi = self._upscale_roi(mask, index_maps)
+            if roi is None:
+                return self._roi_rle(None, 0, 0, height, width)
+            return self._roi_rle(*roi, height, width)
+
+        return self._map_contours(encode, list(masks))
+
+    @staticmethod
+    def _roi_rle(mask, x0, y0, height, width):
+        """
+        Encodes the mask of an image region in COCO uncompressed RLE of the whole image.
+
+        The runs are computed column by column on the region only, the pixels outside of it
+        are zeros. COCO RLE is in column-major order and starts with a run of zeros.
+
+        Args:
+            mask (np.ndarray | None): Binary mask of the region at image resolution, None for an
+                empty mask.
+            x0 (int): X offset of the region in the image.
+            y0 (int): Y offset of the region in the image.
+            height (int): Height of the image.
+            width (int): Width of the image.
+
+        Returns:
+            dict: RLE mask with size and counts.
+        """
+        total = int(height) * int(width)
+        if mask is None or mask.size == 0:
+            return {"size": [int(height), int(width)], "counts": [total]}
+        # Pad every column with zeros, so runs are delimited by +1/-1 steps along the column
+        columns = np.zeros((mask.shape[1], mask.shape[0] + 2), dtype=np.int8)
+        columns[:, 1:-1] = mask.T
+        steps = np.diff(columns, axis=1)
+        column, row = np.nonzero(steps == 1)
+        starts = (x0 + column) * height + y0 + row
+        column, row = np.nonzero(steps == -1)
+        ends = (x0 + column) * height + y0 + row
+        if len(starts) == 0:
+            return {"size": [int(height), int(width)], "counts": [total]}
+        # Runs touching across the bottom of a column and the top of the next one are joined
+        joined = np.flatnonzero(starts[1:] == ends[:-1])
+        starts = np.delete(starts, joined + 1)
+        ends = np.delete(ends, joined)
+        # Alternating lengths of zeros and ones
+        bounds = np.empty(2 * len(starts) + 2, dtype=np.int64)
+        bounds[0] = 0
+        bounds[1:-1:2] = starts
+        bounds[2:-1:2] = ends
+        bounds[-1] = total
+        counts = np.diff(bounds)
+        if counts[-1] == 0:
+            # The mask reaches the last pixel, there are no trailing zeros
+            counts = counts[:-1]
+        return {"size": [int(height), int(width)], "counts": counts.tolist()}
+
+    @staticmethod
+    def _upscale_roi(mask, index_maps):
+        """
+        Upscales the bbox region of a mask to the image resolution.
+
+        Args:
+            mask (np.ndarray): Binary mask at the model mask resolution.
+            index_maps (tuple): Source row and column indices of every image pixel.
+
+        Returns:
+            tuple | None: Region mask with its x, y offsets in the image, None for an empty mask.
+        """
+        rows_map, cols_map = index_maps
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            return None
+        # Image region covered by the mask pixels, with a one pixel empty margin
+        y0 = max(np.searchsorted(rows_map, rows[0], side="left") - 1, 0)
+        y1 = min(np.searchsorted(rows_map, rows[-1], side="right") + 1, len(rows_map))
+        x0 = max(np.searchsorted(cols_map, cols[0], side="left") - 1, 0)
+        x1 = min(np.searchsorted(cols_map, cols[-1], side="right") + 1, len(cols_map))
+        # Upscale only the region of the instance
+        return mask[rows_map[y0:y1]][:, cols_map[x0:x1]], x0, y0
+
+    @staticmethod
+    def _minimize_contour(mask, index_maps):
+        """
+        Extracts the minimized contour of a single mask, working only on its bbox region.
+
+        Args:
+            mask (np.ndarray): Binary mask at the model mask resolution.
+            index_maps (tuple): Source row and column indices of every image pixel.
+
+        Returns:
+            list: Minimized contour as a flat list of integer x, y coordinates.
+        """
+        roi = Inferencer._upscale_roi(mask, index_maps)
+        if roi is None:
+            return []
+        return Inferencer._roi_contour(*roi)
+
+    @staticmethod
+    def _roi_contour(mask, x0, y0, minimize=True):
+        """
+        Extracts the largest contour of a mask covering a region of the image.
+
+        Args:
+            mask (np.ndarray): Binary mask of the region at image resolution.
+            x0 (int): X offset of the region in the image.
+            y0 (int): Y offset of the region in the image.
+            minimize (bool, optional): Whether the contour is simplified. Defaults to True.
+
+        Returns:
+            list: Contour as a flat list of x, y image coordinates, integers when minimized.
+        """
+        # Find all contours without hierarchy
+        mask_contours, _ = cv2.findContours(
+            mask.astype(np.uint8), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0))
+        )
+        if len(mask_contours) == 0:
+            return []
+        # Select the contour with the largest area
+        max_contour = max(mask_contours, key=cv2.contourArea)
+        if not minimize:
+            return max_contour.reshape(-1).astype(np.float64).tolist()
+        # Simplify the contour
+        epsilon = 0.002 * cv2.arcLength(max_contour, True)  # Set the approximation accuracy
+        approx = cv2.approxPolyDP(max_contour, epsilon, True)  # Get the approximated contour
+        # Convert all coordinate values to integers
+        return list(map(int, approx.reshape(-1)))
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+from elements.Element import Element
+
+
+class Journal:
+    """Class for checkpointing per-image inference results to a JSONL journal.
+
+    The first line of the journal holds the hash of the run settings, every following line
+    holds the results of one image. A journal written with other settings is discarded,
+    and a line cut by a crash is dropped when the journal is opened.
+
+    Attributes:
+        journal_path (str): Path to the journal file.
+        settings_hash (str): Hash of the run settings.
+    """
+
+    def __init__(self, journal_path, settings):
+        """Initialization of the Journal object, validates an existing journal.
+
+        Args:
+            journal_path (str): Path to the journal file.
+            settings (dict): JSON serializable settings of the run.
+        """
+        self.journal_path = journal_path
+        self.settings_hash = hashlib.sha256(
+            json.dumps(settings, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        self.file_names = self._validate()
+
+    def _validate(self):
+        """Checks the existing journal and truncates it after the last complete line.
+
+        Returns:
+            set: File names of the images already in the journal.
+        """
+        file_names = set()
+        if not os.path.exists(self.journal_path):
+            return file_names
+
+        valid_size = 0
+        with open(self.journal_path, "rb") as file:
+            header = file.readline()
+            try:
+                settings_hash = json.loads(header)["settings"]
+            except (ValueError, KeyError, TypeError):
+                settings_hash = None
+            if settings_hash != self.settings_hash or not header.endswith(b"\n"):
+                print(
+                    f"Journal '{self.journal_path}' was written with other settings, starting over"
+                )
+                os.remove(self.journal_path)
+                return file_names
+            valid_size = len(header)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    file_names.add(json.loads(line)["file_name"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                valid_size += len(line)
+
+        # Drop a line cut by a crash so that new results are appended after complete lines
+        with open(self.journal_path, "r+b") as file:
+            file.truncate(valid_size)
+        return file_names
+
+    def replay(self):
+        """Lazily restores the elements recorded in the journal.
+
+        Yields:
+            Element: Element with the recorded inference results.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "r") as file:
+            file.readline()  # Settings header
+            for line in file:
+                yield Element.from_dict(json.loads(line))
+
+    def record(self, elements):
+        """Appends the results of each element to the journal as it passes through.
+
+        Args:
+            elements (iterable): Elements with inference results, e.g. an Inferencer stream.
+
+        Yields:
+            Element: The same elements, after they are written to the journal.
+        """
+        new_journal = not os.path.exists(self.journal_path)
+        with open(self.journal_path, "a") as file:
+            if new_journal:
+                file.write(json.dumps({"settings": self.settings_hash}) + "\n")
+            for element in elements:
+                file.write(json.dumps(element.to_dict()) + "\n")
+                file.flush()
+                yield element
+
+    def remove(self):
+        """Deletes the journal once the final export is written."""
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
@@ -0,0 +1,108 @@
+import json
+from nodes.AnnotMaker import COCOConverter, COCO_ARCNAME, coco_header, load_coco
+from nodes.Archiver import ZipArchiver
+
+
+class COCOMerger:
+    """Class for merging several COCO exports, e.g. the shards of one CVAT task, into one.
+
+    Categories are matched by name, so several model classes mapped to the same CVAT name
+    stay one category. Images and annotations are renumbered to stay globally unique, and an
+    image present in several exports is only kept once.
+
+    Attributes:
+        categories (list): COCO categories of the merged export.
+        images (list): COCO images of the merged export.
+        annotations (list): COCO annotations of the merged export.
+    """
+
+    def __init__(self, category_names=None, category_id=None):
+        """Initialization of the COCOMerger object.
+
+        Args:
+            category_names (list, optional): CVAT names of the config classes. When given, the
+                categories are built the same way as COCOConverter does, otherwise they are
+                taken from the merged exports. Defaults to None.
+            category_id (list, optional): Model class IDs of the config classes. Defaults to None.
+        """
+        self.fixed_categories = category_names is not None
+        self.categories = []
+        if self.fixed_categories:
+            self.categories = COCOConverter([], category_names, category_id).categories()
+        self.images = []
+        self.annotations = []
+        self._file_names = set()
+
+    def add(self, coco):
+        """Adds the images and annotations of a COCO export.
+
+        Args:
+            coco (dict): COCO data.
+        """
+        # Category IDs of the export -> merged category IDs, matched by name
+        name_to_id = {category["name"]: category["id"] for category in self.categories}
+        for category in coco["categories"]:
+            if category["name"] not in name_to_id and not self.fixed_categories:
+                new_id = max(name_to_id.values(), default=0) + 1
+                self.categories.append(dict(category, id=new_id))
+                name_to_id[category["name"]] = new_id
+        category_ids = {
+            category["id"]: name_to_id.get(category["name"]) for category in coco["categories"]
+        }
+
+        image_ids = {}
+        for image in coco["images"]:
+            if image["file_name"] in self._file_names:
+                continue
+            self._file_names.add(image["file_name"])
+            image_ids[image["id"]] = len(self.images) + 1
+            self.images.append(dict(image, id=image_ids[image["id"]]))
+
+        dropped = 0
+        for annotation in coco["annotations"]:
+            category_id = category_ids.get(annotation["category_id"])
+            if annotation["image_id"] not in image_ids or category_id is None:
+                dropped += 1
+                continue
+            self.annotations.append(
+                dict(
+                    annotation,
+                    id=len(self.annotations) + 1,
+                    image_id=image_ids[annotation["image_id"]],
+                    category_id=category_id,
+                )
+            )
+        if dropped:
+            print(f"{dropped} annotations of duplicate images or unknown categories were dropped")
+
+    def write(self, file):
+        """Writes the merged export in COCO format into a text file object.
+
+        Args:
+            file: Writable text file object, e.g. an opened output file or a zip entry.
+        """
+        coco_data = coco_header(self.categories)
+        coco_data["images"] = self.images
+        coco_data["annotations"] = self.annotations
+        json.dump(coco_data, file)
+
+
+def merge_archives(zip_paths, output_path, category_names=None, category_id=None):
+    """Merges CVAT annotation archives into one CVAT importable archive.
+
+    Args:
+        zip_paths (list): Paths to the annotation zip archives, e.g. one per shard.
+        output_path (str): Path of the merged zip archive.
+        category_names (list, optional): CVAT names of the config classes. Defaults to None.
+        category_id (list, optional): Model class IDs of the config classes. Defaults to None.
+    """
+    merger = COCOMerger(category_names, category_id)
+    with ZipArchiver(output_path) as archive:
+        copied = set()
+        for zip_path in zip_paths:
+            merger.add(load_coco(zip_path))
+            # The images are copied entry by entry, without extracting the archives
+            copied |= archive.copy_entries(zip_path, "images/", skip=copied)
+        # The annotations are the last entry
+        with archive.open_text(COCO_ARCNAME) as output_file:
+            merger.write(output_file)
@@ -0,0 +1,48 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    """Class for preparing upcoming elements in a pool of worker threads.
+
+    The elements are consumed from the source iterable in order and handed to the workers,
+    at most depth of them are prepared ahead of the consumer. OpenCV releases the GIL while
+    decoding, so images are decoded while the model is busy with the current batch.
+
+    Attributes:
+        elements (iterable): Source of elements, usually a lazy DataGen stream.
+        load (callable): Function preparing a single element, e.g. decoding its image.
+        num_workers (int): Number of worker threads.
+        depth (int): Maximum number of elements prepared ahead of the consumer.
+    """
+
+    def __init__(self, elements, load, num_workers=4, depth=16):
+        """Initialization of the Prefetcher object.
+
+        Args:
+            elements (iterable): Source of elements, usually a lazy DataGen stream.
+            load (callable): Function preparing a single element, e.g. decoding its image.
+            num_workers (int, optional): Number of worker threads. Defaults to 4.
+            depth (int, optional): Maximum number of elements prepared ahead. Defaults to 16.
+        """
+        self.elements = elements
+        self.load = load
+        self.num_workers = max(1, int(num_workers))
+        self.depth = max(1, int(depth))
+
+    def __iter__(self):
+        """Yields the prepared elements in the order of the source iterable.
+
+        Yields:
+            Element: Element returned by the load function.
+        """
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            # Bounded queue of elements being prepared
+            pending = deque()
+            for element in self.elements:
+                pending.append(executor.submit(self.load, element))
+                # The depth can be lowered while iterating, e.g. by a memory scheduler
+                while len(pending) >= self.depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
@@ -0,0 +1,177 @@
+import sys
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on POSIX systems
+    resource = None
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process.
+
+    Returns:
+        float: Peak RSS in megabytes, 0.0 where it can not be measured (Windows).
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class Profiler:
+    """Class collecting per-stage timings, per-image latencies and memory usage of a run.
+
+    Stages are timed with the stage context manager and accumulated over all calls, also when
+    they run in worker threads (e.g. decoding), so the time of parallel stages can exceed the
+    wall time of the run. Stages can be nested, e.g. contour minimization is a part of the
+    postprocessing time.
+
+    Attributes:
+        stages (dict): Accumulated seconds, number of calls and peak RSS of each stage.
+        counters (dict): Processed images and detections.
+        latencies (list): Seconds from the start of decoding to the results of each image.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        """Initialization of the Profiler object, the run wall time starts here."""
+        self.stages = {}
+        self.counters = {"images": 0, "detections": 0}
+        self.latencies = []
+        self._started = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times a block of code as a part of a stage.
+
+        Args:
+            name (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                stats = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                stats["seconds"] += seconds
+                stats["calls"] += 1
+                stats["peak_rss_mb"] = peak_rss_mb()
+
+    def start_image(self, key):
+        """Marks the start of the processing of an image.
+
+        Args:
+            key (str): Key of the image, e.g. its file name.
+        """
+        with self._lock:
+            self._started[key] = time.perf_counter()
+
+    def finish_image(self, key, detections=0):
+        """Marks the end of the processing of an image.
+
+        Args:
+            key (str): Key of the image given to start_image.
+            detections (int, optional): Number of detections of the image. Defaults to 0.
+        """
+        with self._lock:
+            start = self._started.pop(key, None)
+            if start is not None:
+                self.latencies.append(time.perf_counter() - start)
+            self.counters["images"] += 1
+            self.counters["detections"] += detections
+
+    def report(self):
+        """Builds the report of the run.
+
+        Returns:
+            dict: Wall time, throughput, peak RSS, latency percentiles and per-stage timings.
+        """
+        wall_time = time.perf_counter() - self._start
+        images = self.counters["images"]
+        detections = self.counters["detections"]
+        report = {
+            "wall_time": wall_time,
+            "images": images,
+            "detections": detections,
+            "images_per_sec": images / wall_time if wall_time > 0 else None,
+            "detections_per_sec": detections / wall_time if wall_time > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "latency": None,
+            "stages": {},
+        }
+        if self.latencies:
+            latencies = np.array(self.latencies)
+            report["latency"] = {
+                f"p{q}": float(np.percentile(latencies, q)) for q in (50, 90, 95, 99)
+            }
+            report["latency"]["mean"] = float(latencies.mean())
+            report["latency"]["max"] = float(latencies.max())
+        for name, stats in self.stages.items():
+            seconds = stats["seconds"]
+            report["stages"][name] = dict(
+                stats,
+                share=seconds / wall_time if wall_time > 0 else None,
+                images_per_sec=images / seconds if seconds > 0 else None,
+            )
+        return report
+
+    def save(self, path):
+        """Writes the report to a JSON file and prints a summary table.
+
+        Args:
+            path (str): Path to the JSON report.
+
+        Returns:
+            dict: The report.
+        """
+        report = self.report()
+        with open(path, "w") as file:
+            json.dump(report, file, indent=2)
+
+        print(f"{'stage':<20}{'seconds':>10}{'share':>8}{'calls':>8}{'img/s':>10}{'RSS MB':>10}")
+        for name, stats in report["stages"].items():
+            images_per_sec = stats["images_per_sec"] or 0.0
+            print(
+                f"{name:<20}{stats['seconds']:>10.3f}{stats['share']:>8.1%}{stats['calls']:>8}"
+                f"{images_per_sec:>10.1f}{stats['peak_rss_mb']:>10.1f}"
+            )
+        print(
+            f"{report['images']} images, {report['detections']} detections in "
+            f"{report['wall_time']:.2f} s: {report['images_per_sec']:.2f} img/s, "
+            f"{report['detections_per_sec']:.1f} det/s, peak RSS {report['peak_rss_mb']:.1f} MB"
+        )
+        if report["latency"] is not None:
+            latency = report["latency"]
+            print(
+                f"Per-image latency: p50 {latency['p50'] * 1000:.1f} ms, "
+                f"p90 {latency['p90'] * 1000:.1f} ms, p99 {latency['p99'] * 1000:.1f} ms"
+            )
+        print(f"Profile report is located at: {path}")
+        return report
+
+
+class NullProfiler:
+    """Profiler doing nothing, used when profiling is off so the hooks cost close to nothing."""
+
+    enabled = False
+    _null_stage = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def start_image(self, key):
+        pass
+
+    def finish_image(self, key, detections=0):
+        pass
@@ -0,0 +1,151 @@
+import os
+from nodes.Profiler import peak_rss_mb
+
+
+def current_rss_mb():
+    """Returns the current resident set size of the process.
+
+    Reads /proc/self/statm on Linux, other systems fall back to the peak RSS, which is not
+    measured on Windows, so there the budget is only kept through the estimated image costs.
+
+    Returns:
+        float: RSS in megabytes.
+    """
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_rss_mb()
+
+
+class MemoryScheduler:
+    """Class adapting the number of images in flight to a memory budget.
+
+    The images in flight are the decoded images waiting in the prefetch queue and the batch in
+    the model. Their number grows by one after every batch as long as the estimated cost of one
+    more image fits the budget, and is halved as soon as the RSS gets close to the budget
+    (additive increase, multiplicative decrease). The cost of an image is estimated from its
+    resolution and detection count: the decoded BGR pixels plus one full resolution mask per
+    detection in segmentation mode. The resolution of the next images is known once they are
+    decoded, so a batch is also closed early when its estimated cost does not fit the budget,
+    e.g. when a few 8K images follow a run of small ones.
+
+    Attributes:
+        budget (float): Memory budget of the process in megabytes.
+        max_batch_size (int): Upper bound of the batch size.
+        max_in_flight (int): Upper bound of the number of images in flight.
+        in_flight (int): Current number of images in flight.
+        batch_size (int): Current batch size.
+        prefetch_depth (int): Current number of images decoded ahead of the model.
+        peak (float): Highest RSS observed during the current batch, in megabytes.
+    """
+
+    # Fraction of the budget above which the images in flight are halved
+    backoff_ratio = 0.9
+    # Fraction of the budget the estimated usage has to stay under to admit one more image
+    grow_ratio = 0.8
+
+    def __init__(self, budget_mb, max_batch_size, max_in_flight, segment=False, mask_pixels=None):
+        """Initialization of the MemoryScheduler object.
+
+        Args:
+            budget_mb (float): Memory budget of the process in megabytes.
+            max_batch_size (int): Upper bound of the batch size.
+            max_in_flight (int): Upper bound of the number of images in flight.
+            segment (bool, optional): Whether full resolution masks are allocated per detection.
+                Defaults to False.
+            mask_pixels (int, optional): Pixels of a mask when they do not depend on the image
+                size, e.g. the tile area in sliced inference. Defaults to None.
+        """
+        self.budget = float(budget_mb)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_in_flight = max(self.max_batch_size, int(max_in_flight))
+        self.segment = segment
+        self.mask_pixels = mask_pixels
+        self.in_flight = 1
+        self.batch_size = 1
+        self.prefetch_depth = 1
+        self.peak = 0.0
+        self._image_mb = None  # Decaying maximum of the estimated cost of an image
+        self._detections = 0.0  # Decaying maximum of the number of detections of an image
+
+    def sample(self):
+        """Records the current RSS, called at the points where the memory usage peaks."""
+        self.peak = max(self.peak, current_rss_mb())
+
+    def estimate_mb(self, width, height, detections):
+        """Estimates the memory needed to process an image.
+
+        Args:
+            width (int): Width of the image.
+            height (int): Height of the image.
+            detections (int): Number of detections in the image.
+
+        Returns:
+            float: Estimated cost in megabytes.
+        """
+        pixels = int(width) * int(height)
+        cost = pixels * 3  # Decoded BGR image
+        if self.segment:
+            # A float mask upscaled to the image and its binary copy for every detection
+            mask_pixels = pixels if self.mask_pixels is None else self.mask_pixels
+            cost += detections * mask_pixels * 5
+        return cost / (1024 * 1024)
+
+    def fits(self, batch):
+        """Checks whether a batch of decoded images can go through the model within the budget.
+
+        Args:
+            batch (list): Elements with decoded images.
+
+        Returns:
+            bool: True if the estimated cost of the batch fits the budget.
+        """
+        cost = sum(
+            self.estimate_mb(element.width, element.height, self._detections)
+            for element in batch
+            if element.width and element.height
+        )
+        return current_rss_mb() + cost < self.backoff_ratio * self.budget
+
+    def update(self, batch):
+        """Adapts the images in flight after a batch is processed.
+
+        Args:
+            batch (list): Processed elements with their size and detections.
+        """
+        costs = [
+            self.estimate_mb(element.width, element.height, len(element.annotations_id))
+            for element in batch
+            if element.width and element.height and element.annotations_id is not None
+        ]
+        if costs:
+            cost = max(costs)
+            # A large image raises the estimate at once, it decays over the next batches
+            self._image_mb = cost if self._image_mb is None else max(cost, 0.7 * self._image_mb)
+            detections = max(
+                len(element.annotations_id)
+                for element in batch
+                if element.annotations_id is not None
+            )
+            self._detections = max(detections, 0.7 * self._detections)
+
+        self.sample()
+        rss = self.peak
+        self.peak = 0.0
+        if rss > self.backoff_ratio * self.budget:
+            if self.in_flight > 1:
+                self.in_flight = max(1, self.in_flight // 2)
+                print(
+                    f"Memory usage {rss:.0f} MB is close to the {self.budget:.0f} MB budget, "
+                    f"{self.in_flight} images in flight"
+                )
+        elif self.in_flight < self.max_in_flight:
+            # The peak already holds the images in flight, one more image adds its own cost
+            if rss + (self._image_mb or 0.0) < self.grow_ratio * self.budget:
+                self.in_flight += 1
+
+        # Half of the images in flight go through the model together, the rest are prefetched
+        self.batch_size = min(self.max_batch_size, max(1, (self.in_flight + 1) // 2))
+        self.prefetch_depth = max(1, self.in_flight - self.batch_size)
@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import tempfile
+import urllib.error
+import urllib.request
+
+
+class ModelCache:
+    """Class keeping the models of the annotation server loaded between jobs.
+
+    Models are created on first use and cached per weights path, a weights file modified on
+    disk is loaded again.
+
+    Attributes:
+        models (dict): Loaded models by their cache key.
+    """
+
+    def __init__(self):
+        """Initialization of the ModelCache object."""
+        self.models = {}
+
+    def yolo(self, model_path, backend="torch", imgsz=640):
+        """Returns the YOLO model of a weights file.
+
+        Args:
+            model_path (str): Path to the model weights, or a model name known to ultralytics.
+            backend (str, optional): Runtime of the model, see load_model. Defaults to "torch".
+            imgsz (int, optional): Input image size of exported models. Defaults to 640.
+
+        Returns:
+            YOLO: Loaded model.
+        """
+        key = ("yolo", model_path, self._mtime(model_path), backend)
+        if backend != "torch":
+            key += (imgsz,)
+        if key not in self.models:
+            from nodes.Backend import load_model
+
+            self.models[key] = load_model(model_path, backend, imgsz)
+        return self.models[key]
+
+    def fastsam(self, sam_imgsz):
+        """Returns the FastSAM predictor used for zero-shot segmentation.
+
+        Args:
+            sam_imgsz (int): Input image size of FastSAM.
+
+        Returns:
+            FastSAMPredictor: Predictor segmenting everything in an image.
+        """
+        key = ("fastsam", sam_imgsz)
+        if key not in self.models:
+            from nodes.Inference import Inferencer
+
+            self.models[key] = Inferencer.create_sam_predictor(sam_imgsz)
+        return self.models[key]
+
+    @staticmethod
+    def _mtime(path):
+        return os.path.getmtime(path) if os.path.isfile(path) else None
+
+
+class AnnotationServer:
+    """Class for a local HTTP service annotating CVAT tasks with warm models.
+
+    Jobs are the CLI options of AutoCvat sent as JSON. They are queued and run one at a time
+    in a worker thread, the models stay loaded in a ModelCache between jobs. The result
+    archive of a finished job is downloaded once and then removed, a failed job is removed
+    once its status is read.
+
+    The server reads the files named in the options of a job and sends back an archive of the
+    image folder, so it only accepts connections from other machines when the paths of the
+    jobs are restricted to an allowed root folder.
+
+    Endpoints:
+        POST /jobs: Queues a job, the body is {"options": {...}}.
+        GET /jobs/<id>: Status of a job: queued, running, done or failed.
+        GET /jobs/<id>/archive: COCO archive of a finished job.
+        GET /health: Number of loaded models and queued jobs.
+
+    Attributes:
+        runner (callable): Function running a job, called as runner(options, models).
+        host (str): Address the server listens on.
+        port (int): Port the server listens on.
+        work_dir (str): Folder with the archives of the jobs.
+        models (ModelCache): Models shared by the jobs.
+        jobs (dict): Jobs by their ID.
+        allowed_root (str | None): Folder the paths of the jobs have to be in, None allows any
+            path.
+    """
+
+    # Options naming files or folders read by a job
+    path_options = ("img_folder", "weights", "yaml_pth", "merge_with")
+
+    def __init__(self, runner, host="127.0.0.1", port=8765, work_dir=None, allowed_root=None):
+        """Initialization of the AnnotationServer object.
+
+        Args:
+            runner (callable): Function running a job, called as runner(options, models).
+            host (str, optional): Address the server listens on. Defaults to "127.0.0.1".
+            port (int, optional): Port the server listens on. Defaults to 8765.
+            work_dir (str, optional): Folder with the archives of the jobs, a temporary folder
+                is created when None. Defaults to None.
+            allowed_root (str, optional): Folder the paths of the jobs have to be in, required
+                when the server listens on a non-loopback address. Defaults to None.
+
+        Raises:
+            ValueError: If the server listens on a non-loopback address without allowed_root.
+        """
+        if allowed_root is None and not is_loopback(host):
+            raise ValueError(
+                f"The server exposes the files of this machine, listening on {host} requires "
+                "an allowed root folder for the paths of the jobs"
+            )
+        self.runner = runner
+        self.host = host
+        self.port = port
+        self.work_dir = work_dir if work_dir is not None else tempfile.mkdtemp(prefix="autocvat_")
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.models = ModelCache()
+        self.jobs = {}
+        self.allowed_root = os.path.realpath(allowed_root) if allowed_root is not None else None
+        self._queue = None
+
+    def serve(self):
+        """Runs the server until it is interrupted."""
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._queue = asyncio.Queue()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        worker = asyncio.create_task(self._worker())
+        print(f"Annotation server is listening on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            worker.cancel()
+
+    async def _worker(self):
+        """Runs the queued jobs one after another in a worker thread."""
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            try:
+                await loop.run_in_executor(None, self._run_job, job_id)
+                job["status"] = "done"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                print(f"Job {job_id} failed: {e}")
+                shutil.rmtree(os.path.join(self.work_dir, job_id), ignore_errors=True)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job_id):
+        """Runs a single job, the archive is written into the folder of the job.
+
+        Args:
+            job_id (str): ID of the job.
+        """
+        job = self.jobs[job_id]
+        job_dir = os.path.join(self.work_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        options = dict(
+            job["options"],
+            annotations_zip=os.path.join(job_dir, "annotations"),
+            save_photo=False,
+            cvat_json=False,
+            server=None,
+        )
+        start = time.perf_counter()
+        self.runner(options, self.models)
+        job["archive"] = options["annotations_zip"] + ".zip"
+        print(f"Job {job_id} is done in {time.perf_counter() - start:.2f} s")
+
+    async def _handle(self, reader, writer):
+        """Handles a single HTTP request."""
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            body = await reader.readexactly(length) if length else b""
+            await self._route(method, path.rstrip("/").split("/")[1:], body, writer)
+        except (ValueError, KeyError) as e:
+            await self._respond(writer, 400, {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def _route(self, method, parts, body, writer):
+        """Dispatches a request to its endpoint.
+
+        Args:
+            method (str): HTTP method.
+            parts (list): Parts of the request path.
+            body (bytes): Request body.
+            writer (StreamWriter): Connection to respond to.
+        """
+        if method == "GET" and parts == ["health"]:
+            await self._respond(
+                writer, 200, {"models": len(self.models.models), "queued": self._queue.qsize()}
+            )
+        elif method == "POST" and parts == ["jobs"]:
+            options = json.loads(body)["options"]
+            self._check_options(options)
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "status": "queued",
+                "options": options,
+                "error": None,
+                "archive": None,
+            }
+            self._queue.put_nowait(job_id)
+            await self._respond(writer, 202, {"job_id": job_id, "queued": self._queue.qsize()})
+        elif method == "GET" and len(parts) == 2 and parts[0] == "jobs" and parts[1] in self.jobs:
+            job = self.jobs[parts[1]]
+            if job["status"] == "failed":
+                # The client learns about the failure once, the job is not kept afterwards
+                del self.jobs[parts[1]]
+            await self._respond(writer, 200, {"status": job["status"], "error": job["error"]})
+        elif (
+            method == "GET"
+            and len(parts) == 3
+            and parts[0] == "jobs"
+            and parts[2] == "archive"
+            and self.jobs.get(parts[1], {}).get("status") == "done"
+        ):
+            await self._send_archive(parts[1], writer)
+        else:
+            await self._respond(writer, 404, {"error": "Not found"})
+
+    def _check_options(self, options):
+        """Rejects the options a job can not run with on this server.
+
+        Args:
+            options (dict): CLI options of the job.
+
+        Raises:
+            ValueError: If the job resumes from a journal, or reads a path outside of the
+                allowed root.
+        """
+        if options.get("resume"):
+            # The journal is written in the folder of the job, which is removed with it
+            raise ValueError("--resume is not supported by the annotation server")
+        if self.allowed_root is None:
+            return
+        for name in self.path_options:
+            value = options.get(name)
+            if value is None or not os.path.exists(value):
+                continue
+            path = os.path.realpath(value)
+            if os.path.commonpath([path, self.allowed_root]) != self.allowed_root:
+                raise ValueError(f"--{name} is outside of the folder allowed by the server")
+
+    async def _send_archive(self, job_id, writer):
+        """Streams the archive of a finished job and removes the job."""
+        archive = self.jobs.pop(job_id)["archive"]
+        headers = (
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/zip\r\n"
+            f"Content-Length: {os.path.getsize(archive)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("latin-1"))
+        with open(archive, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                writer.write(chunk)
+                await writer.drain()
+        shutil.rmtree(os.path.dirname(archive), ignore_errors=True)
+
+    @staticmethod
+    async def _respond(writer, status, data):
+        """Sends a JSON response."""
+        reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found"}
+        body = json.dumps(data).encode()
+        headers = (
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(headers.encode("latin-1") + body)
+        await writer.drain()
+
+
+def is_loopback(host):
+    """Checks whether an address only accepts connections from the same machine.
+
+    Args:
+        host (str): Address a server listens on.
+
+    Returns:
+        bool: True for localhost and loopback addresses.
+    """
+    return host == "localhost" or host == "::1" or host.startswith("127.")
+
+
+def submit_job(server, options, output_path, poll_interval=0.2):
+    """Runs a job on an annotation server and downloads its archive.
+
+    Args:
+        server (str): URL of the server, e.g. http://127.0.0.1:8765.
+        options (dict): CLI options of AutoCvat with absolute paths.
+        output_path (str): Path the COCO archive is saved to.
+        poll_interval (float, optional): Seconds between status requests. Defaults to 0.2.
+
+    Raises:
+        RuntimeError: If the server rejected the job or the job failed on the server.
+    """
+    server = server.rstrip("/")
+    request = urllib.request.Request(
+        f"{server}/jobs",
+        data=json.dumps({"options": options}).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            job_id = json.load(response)["job_id"]
+    except urllib.error.HTTPError as e:
+        if e.code != 400:
+            raise
+        raise RuntimeError(f"The server rejected the job: {json.load(e)['error']}")
+
+    while True:
+        with urllib.request.urlopen(f"{server}/jobs/{job_id}") as response:
+            status = json.load(response)
+        if status["status"] == "done":
+            break
+        if status["status"] == "failed":
+            raise RuntimeError(f"Job {job_id} failed on the server: {status['error']}")
+        time.sleep(poll_interval)
+
+    with urllib.request.urlopen(f"{server}/jobs/{job_id}/archive") as response:
+        with open(output_path, "wb") as file:
+            shutil.copyfileobj(response, file)